@@ -9,8 +9,20 @@ class Config:
     def __init__(self) -> None:
         self.telegram_bot_token: str = os.getenv("TELEGRAM_BOT_TOKEN")
         self.api_base_url: str = os.getenv("API_BASE_URL")
-        self.upload_endpoint: str = "/upload/"
+        self.upload_endpoint: str = "/upload/files/"
         self.fastapi_upload_url: str = f"{self.api_base_url}{self.upload_endpoint}"
+        self.batch_upload_endpoint: str = "/upload/batch/"
+        self.fastapi_batch_upload_url: str = f"{self.api_base_url}{self.batch_upload_endpoint}"
+        self.http_max_connections: int = int(os.getenv("HTTP_MAX_CONNECTIONS", 200))
+        self.http_timeout: float = float(os.getenv("HTTP_TIMEOUT", 30))
+        self.catalog_refresh_interval: float = float(os.getenv("CATALOG_REFRESH_INTERVAL", 300))
+        self.file_id_cache_path: str = os.getenv("FILE_ID_CACHE_PATH", "file_ids.db")
+        self.photo_max_side: int = int(os.getenv("PHOTO_MAX_SIDE", 1024))
+        self.photo_jpeg_quality: int = int(os.getenv("PHOTO_JPEG_QUALITY", 90))
+        self.max_jobs_per_user: int = int(os.getenv("MAX_JOBS_PER_USER", 1))
+        self.concurrent_updates: int = int(os.getenv("CONCURRENT_UPDATES", 256))
+        self.metrics_host: str = os.getenv("METRICS_HOST", "127.0.0.1")
+        self.metrics_port: int = int(os.getenv("METRICS_PORT", 0))
 
         if not self.telegram_bot_token or not self.api_base_url:
             raise EnvironmentError("Please set TELEGRAM_BOT_TOKEN and API_BASE_URL in the .env file.")
\ No newline at end of file
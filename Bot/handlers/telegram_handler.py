@@ -1,25 +1,77 @@
 import logging
 import os
-import base64
+import hashlib
+import io
 import httpx
 import asyncio
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+import time
+from functools import partial
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto
 from telegram.ext import ContextTypes
+from telegram.error import BadRequest
 from services.product_service import ProductService
 from services.upload_service import UploadService
+from services.file_id_cache import FileIdCache
+from services.metrics import registry
 from telegram.constants import ParseMode
 from helpers.telegram_helpers import escape_special_chars
+from helpers.image_helpers import downscale_photo
+
+LONG_POLL_TIMEOUT = 25
+POLL_INITIAL_DELAY = 1.0
+POLL_BACKOFF_FACTOR = 1.5
+POLL_MAX_DELAY = 12.0
+# How long to keep retrying a status that is not found or unreachable, e.g. while the server restarts and resumes its jobs.
+POLL_RETRY_WINDOW = 120.0
+# Telegram media groups hold at most ten photos.
+BATCH_MAX_ITEMS = 10
+# Products per page of the product list, also the page size in which the catalog is fetched while browsing it.
+CATALOG_PAGE_SIZE = 8
+
+# Quality modes offered after selecting a product, mapped to the server's (quality, progressive) upload fields.
+QUALITY_MODES = {
+    'preview': ('preview', False),
+    'full': ('full', False),
+    'progressive': ('full', True),
+}
+
+stage_seconds = registry.histogram("bot_stage_seconds", "Time spent in each stage of handling a try-on.", ("stage",))
+handler_calls_total = registry.counter("bot_handler_calls_total", "Handler invocations, by handler.", ("handler",))
+handler_errors_total = registry.counter("bot_handler_errors_total", "Handler invocations that raised, by handler.",
+                                        ("handler",))
+handler_seconds = registry.histogram("bot_handler_duration_seconds", "Time spent in each handler.", ("handler",))
+
+class StatusUnavailableError(Exception):
+    """Raised when the server does not know a task, which may only last until it has resumed its jobs after a restart."""
+
+def instrument(name: str, callback):
+    """Wrap a handler callback so that its calls, errors and duration are recorded under name."""
+    async def instrumented(update: Update, context: ContextTypes.DEFAULT_TYPE, *args):
+        handler_calls_total.inc(handler=name)
+        with handler_seconds.time(handler=name):
+            try:
+                return await callback(update, context, *args)
+            except Exception:
+                handler_errors_total.inc(handler=name)
+                raise
+    return instrumented
 
 class TelegramHandler:
     """Handler for managing Telegram bot interactions."""
     
-    def __init__(self, product_service: ProductService, upload_service: UploadService, base_url_api: str) -> None:
+    def __init__(self, product_service: ProductService, upload_service: UploadService, base_url_api: str,
+                 http_client: httpx.AsyncClient, file_id_cache: FileIdCache,
+                 photo_max_side: int = 0, photo_jpeg_quality: int = 90, max_jobs_per_user: int = 1) -> None:
         self.product_service = product_service
         self.upload_service = upload_service
         self.base_url_api = base_url_api
-        self.products = []
+        self.http_client = http_client
+        self.file_id_cache = file_id_cache
+        self.photo_max_side = photo_max_side
+        self.photo_jpeg_quality = photo_jpeg_quality
+        self.max_jobs_per_user = max_jobs_per_user
 
-        self.command_map = {
+        commands = {
             'start': self.start_menu,
             'next_product': self.next_product,
             'previous_product': self.previous_product,
@@ -28,17 +80,41 @@ class TelegramHandler:
             'how_to_send_photo': self.how_to_send_photo,
             'list_of_products': self.handle_list_of_products,
             'return_to_menu': self.start_menu,
-            'show_catalog':self.show_catalog
+            'show_catalog':self.show_catalog,
+            'browse_catalog': self.browse_catalog,
+            'toggle_batch': self.toggle_batch,
+            'select_batch': self.select_batch,
+            'quality_preview': partial(self.set_quality, mode='preview'),
+            'quality_full': partial(self.set_quality, mode='full'),
+            'quality_progressive': partial(self.set_quality, mode='progressive')
+        }
+        self.command_map = {name: instrument(name, callback) for name, callback in commands.items()}
+        # Buttons of paged lists carry a number after the command name, e.g. 'list_page:2'.
+        parameterised_commands = {
+            'list_page': self.show_product_list,
+            'open_product': self.open_product,
         }
+        self.parameterised_command_map = {name: instrument(name, callback)
+                                          for name, callback in parameterised_commands.items()}
+
+    async def current_product(self, context: ContextTypes.DEFAULT_TYPE):
+        """Fetches the product the user is looking at in the catalog or in their search results, remembering how many there are."""
+        product, total = await self.product_service.get_product(context.user_data.get('current_product_index', 0),
+                                                                CATALOG_PAGE_SIZE, context.user_data.get('catalog_query'))
+        if not total and context.user_data.get('catalog_query'):
+            # The catalog changed and the search no longer matches anything; fall back to the whole catalog.
+            context.user_data['catalog_query'] = None
+            context.user_data['current_product_index'] = 0
+            product, total = await self.product_service.get_product(0, CATALOG_PAGE_SIZE)
+        context.user_data['catalog_total'] = total
+        return product
 
     async def start_menu(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Initializes the start menu for the Telegram bot of the online store assistant."""
-        if not self.products:
-            self.products = await self.product_service.fetch_products()
-
         context.user_data['current_product_index'] = 0
+        context.user_data['catalog_query'] = None
 
-        if not self.products:
+        if await self.current_product(context) is None:
             if update.message:
                 await update.message.reply_text("❌ Ассортимент не найдены. Пожалуйста, попробуйте позже.")
             else:
@@ -65,7 +141,7 @@ class TelegramHandler:
     def get_main_menu_keyboard(self):
         """Returns the main menu keyboard."""
         keyboard = [
-            [InlineKeyboardButton("🔄 Начать", callback_data='show_catalog')],
+            [InlineKeyboardButton("🔄 Начать", callback_data='browse_catalog')],
             [InlineKeyboardButton("❓ Помощь", callback_data='help')]
         ]
         return InlineKeyboardMarkup(keyboard)
@@ -96,81 +172,259 @@ class TelegramHandler:
         await self.send_message(update, "📸 Чтобы отправить изображение, выберите продукт и отправьте фото в формате JPG или PNG.")
 
     async def handle_list_of_products(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Handles the request to list available products."""
-        if not self.products:
+        """Handles the request to list available products, starting from the first page of the whole catalog."""
+        context.user_data['catalog_query'] = None
+        await self.show_product_list(update, context)
+
+    async def search_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Searches the catalog by name, model and color and lists the first page of matching products."""
+        query = " ".join(context.args or []).strip()
+        if not query:
+            await self.send_message(update, "🔎 Использование: /search <название, модель или цвет>")
+            return
+        page = await self.product_service.get_page(0, CATALOG_PAGE_SIZE, query)
+        if page is None:
             await self.send_message(update, "❌ Не удалось получить список товаров.")
             return
-        
-        product_list = "\n".join([f"{i+1}. {product.name}" for i, product in enumerate(self.products)])
-        await self.send_message(update, f"🛍️ Доступные товары:\n{product_list}")
+        if not page.total:
+            # Keep browsing whatever the user had open rather than a search that matches nothing.
+            await self.send_message(update, f"🔎 По запросу «{query}» ничего не найдено.")
+            return
+        context.user_data['catalog_query'] = query
+        context.user_data['current_product_index'] = 0
+        await self.show_product_list(update, context)
+
+    async def show_product_list(self, update: Update, context: ContextTypes.DEFAULT_TYPE, page_number: int = 0):
+        """Lists one page of the catalog or of the user's search results as buttons that open the products."""
+        query = context.user_data.get('catalog_query')
+        page = await self.product_service.get_page(page_number * CATALOG_PAGE_SIZE, CATALOG_PAGE_SIZE, query)
+        if page is None:
+            await self.send_message(update, "❌ Не удалось получить список товаров.")
+            return
+        if not page.total:
+            await self.send_message(update, f"🔎 По запросу «{query}» ничего не найдено." if query else "❌ Ассортимент не найдены.")
+            return
+
+        page_count = (page.total + CATALOG_PAGE_SIZE - 1) // CATALOG_PAGE_SIZE
+        if page_number >= page_count:
+            # A button from an older list can point past the end once the catalog or the search results shrink.
+            page_number = page_count - 1
+            page = await self.product_service.get_page(page_number * CATALOG_PAGE_SIZE, CATALOG_PAGE_SIZE, query)
+            if page is None or not page.products:
+                await self.send_message(update, "❌ Не удалось получить список товаров.")
+                return
+
+        title = f"🔎 Найдено по запросу «{query}»" if query else "🛍️ Доступные товары"
+        await self.send_message(update, f"{title} ({page.total}), стр. {page_number + 1} из {page_count}:",
+                                self.get_product_list_keyboard(page, page_number, page_count, bool(query)))
+
+    def get_product_list_keyboard(self, page, page_number: int, page_count: int, searching: bool = False):
+        """Creates the inline keyboard of one page of the product list with buttons to turn the pages and, for search results, to return to the whole catalog."""
+        keyboard = [[InlineKeyboardButton(f"{page.offset + i + 1}. {product.name}",
+                                          callback_data=f'open_product:{page.offset + i}')]
+                    for i, product in enumerate(page.products)]
+        navigation = []
+        if page_number > 0:
+            navigation.append(InlineKeyboardButton("◀️", callback_data=f'list_page:{page_number - 1}'))
+        if page_number + 1 < page_count:
+            navigation.append(InlineKeyboardButton("▶️", callback_data=f'list_page:{page_number + 1}'))
+        if navigation:
+            keyboard.append(navigation)
+        if searching:
+            keyboard.append([InlineKeyboardButton("🛍️ Весь каталог", callback_data='list_of_products')])
+        keyboard.append([InlineKeyboardButton("🔙 В меню", callback_data='return_to_menu')])
+        return InlineKeyboardMarkup(keyboard)
+
+    async def browse_catalog(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Shows the whole catalog from its first product, leaving any search the user made."""
+        context.user_data['catalog_query'] = None
+        context.user_data['current_product_index'] = 0
+        await self.show_catalog(update, context)
+
+    async def open_product(self, update: Update, context: ContextTypes.DEFAULT_TYPE, index: int):
+        """Shows a product picked from the product list in the catalog view."""
+        context.user_data['current_product_index'] = index
+        await self.show_catalog(update, context)
 
     async def handle_photo(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Handles a user's photo, refusing it right away if the user already has too many try-ons in progress."""
+        active_jobs = context.user_data.get('active_jobs', 0)
+        if active_jobs >= self.max_jobs_per_user:
+            await self.send_message(update, "⏳ Ваше предыдущее фото ещё обрабатывается. Дождитесь результата.")
+            return
+
+        context.user_data['active_jobs'] = active_jobs + 1
+        try:
+            await self.process_photo(update, context)
+        finally:
+            context.user_data['active_jobs'] -= 1
+
+    async def process_photo(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Handles the reception and processing of a user's photo."""
         await self.send_message(update, "⏳ Получаю ваше изображение...")
         
-        current_index = context.user_data.get('current_product_index', 0)
-        selected_product = self.products[current_index]
+        batch_product_ids = list(context.user_data.get('batch_products', {})) if context.user_data.get('batch_mode') else None
+        selected_product = await self.current_product(context) if not batch_product_ids else None
 
-        if not selected_product:
+        if not selected_product and not batch_product_ids:
             await self.send_message(update, "❌ Сначала выберите продукт.")
             return
         
         try:
-            user_photo_file = await update.message.photo[-1].get_file()
-            user_photo_bytes = await user_photo_file.download_as_bytearray()
-            user_photo_extension = os.path.splitext(user_photo_file.file_path)[1].lower()
+            with stage_seconds.time(stage='download'):
+                user_photo_file = await update.message.photo[-1].get_file()
+                user_photo_extension = os.path.splitext(user_photo_file.file_path)[1].lower()
 
-            if user_photo_extension not in ['.png', '.jpg', '.jpeg']:
-                await self.send_message(update, "❌ Пожалуйста, загрузите фото в формате JPG или PNG.")
-                return
+                if user_photo_extension not in ['.png', '.jpg', '.jpeg']:
+                    await self.send_message(update, "❌ Пожалуйста, загрузите фото в формате JPG или PNG.")
+                    return
+
+                user_photo_buffer = io.BytesIO()
+                await user_photo_file.download_to_memory(user_photo_buffer)
+                user_photo_buffer.seek(0)
+
+            if self.photo_max_side:
+                with stage_seconds.time(stage='downscale'):
+                    downscaled_photo = await asyncio.get_running_loop().run_in_executor(
+                        None, downscale_photo, user_photo_buffer.getvalue(), self.photo_max_side, self.photo_jpeg_quality)
+                if downscaled_photo is not None:
+                    user_photo_buffer = io.BytesIO(downscaled_photo)
+                    user_photo_extension = '.jpg'
             
-            product_info = {'product_description': selected_product.description}
-            product_image_bytes = product_image_base64 = await self.upload_service.fetch_product_image(selected_product.image_url)
+            quality, progressive = QUALITY_MODES[context.user_data.get('quality_mode', 'full')]
+            if batch_product_ids:
+                with stage_seconds.time(stage='upload'):
+                    response = await self.upload_service.upload_batch(user_photo_buffer, user_photo_extension,
+                                                                      batch_product_ids, update.effective_user.id, quality)
+                if response and response.get('task_id'):
+                    await self.send_message(update, f"✅ Файл загружен. Примеряю товаров: {len(batch_product_ids)}...")
+                    await self.poll_status(update, response['task_id'], context)
+                else:
+                    await self.send_message(update, "❌ Ошибка при загрузке файла.")
+                return
 
-            user_photo_base64 = base64.b64encode(user_photo_bytes).decode('utf-8')
-            product_image_base64 = base64.b64encode(product_image_bytes).decode('utf-8')
-            response = await self.upload_service.upload_files(user_photo_base64, user_photo_extension, product_image_base64, 
-                                                              os.path.splitext(selected_product.image_url)[1], product_info)
+            with stage_seconds.time(stage='upload'):
+                try:
+                    response = await self.upload_service.upload_for_product(user_photo_buffer, user_photo_extension,
+                                                                            selected_product.id, update.effective_user.id,
+                                                                            quality, progressive)
+                except httpx.HTTPStatusError as e:
+                    if e.response.status_code not in (404, 502):
+                        raise
+                    # The server has no usable copy of this garment, so send the image ourselves.
+                    user_photo_buffer.seek(0)
+                    product_info = {'product_description': selected_product.description, 'user_id': update.effective_user.id,
+                                    'quality': quality, 'progressive': progressive}
+                    product_image_bytes = await self.upload_service.fetch_product_image(selected_product.image_url)
+                    response = await self.upload_service.upload_files(user_photo_buffer, user_photo_extension, product_image_bytes, 
+                                                                      os.path.splitext(selected_product.image_url)[1], product_info)
             
             if response and response.get('task_id'):
                 await self.send_message(update, "✅ Файл загружен. Начинаю обработку...")
                 await self.poll_status(update, response['task_id'], context)
             else:
                 await self.send_message(update, "❌ Ошибка при загрузке файла.")
+
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code == 503:
+                retry_after = e.response.headers.get('Retry-After', '30')
+                await self.send_message(update, f"⏳ Сервер перегружен. Попробуйте снова через {retry_after} сек.")
+            elif e.response.status_code == 429:
+                await self.send_message(update, "⏳ У вас уже есть фото в очереди. Дождитесь результата.")
+            else:
+                await self.send_message(update, "❌ Ошибка при загрузке файла.")
         
         except Exception as e:
             logging.error(f"Error: {e}")
             await self.send_message(update, "❌ Произошла ошибка. Попробуйте снова.")
 
     async def poll_status(self, update: Update, task_id, context: ContextTypes.DEFAULT_TYPE) -> None:
-        """Polls the status of the image processing task and updates the user on the progress."""
+        """Waits on the long-poll status endpoint until the task finishes, falling back to backoff polling, and updates the user on the progress."""
+        use_long_poll = True
+        delay = POLL_INITIAL_DELAY
+        last_progress = None
+        preview_sent = False
+        finished_items = 0
+        started = time.perf_counter()
+        failing_since = None
         processing = True
         while processing:
-            await asyncio.sleep(12)
             try:
-                async with httpx.AsyncClient() as client:
-                    status_response = await client.get(f"{self.base_url_api}/status/{task_id}")
-                    status_response.raise_for_status()
-                    status_data = status_response.json()
-
-                    if status_data['status'] == 'completed':
-                        processed_image_base64 = status_data['result']
-                        img_bytes = base64.b64decode(processed_image_base64)
-                        await update.message.reply_photo(photo=img_bytes)
-                        await asyncio.sleep(3)
-                        await self.send_message(update, "✅ Status: Обработка завершена!")
-                        await self.show_catalog(update, context)
-                        processing = False
-
-                    elif status_data['status'] == 'error':
-                        await self.send_message(update, "❌ Status: Ошибка на стороне IDM-VTON API. Повторите позже.")
-                        await asyncio.sleep(3)
-                        await self.show_catalog(update, context)
-                        processing = False
+                if use_long_poll:
+                    status_response = await self.http_client.get(f"{self.base_url_api}/status/{task_id}/wait",
+                                                                 params={'timeout': LONG_POLL_TIMEOUT,
+                                                                         'known_preview': preview_sent,
+                                                                         'known_finished': finished_items},
+                                                                 timeout=LONG_POLL_TIMEOUT + 10)
+                    if status_response.status_code in (404, 405) and 'status' not in status_response.json():
+                        logging.warning("Long-poll endpoint unavailable, falling back to polling for task %s", task_id)
+                        use_long_poll = False
+                        continue
+                else:
+                    await asyncio.sleep(delay)
+                    delay = min(delay * POLL_BACKOFF_FACTOR, POLL_MAX_DELAY)
+                    status_response = await self.http_client.get(f"{self.base_url_api}/status/{task_id}")
+                if status_response.status_code == 404:
+                    raise StatusUnavailableError(f"Task {task_id} not found")
+                status_response.raise_for_status()
+                status_data = status_response.json()
+                failing_since = None
+
+                if status_data.get('preview_url') and not preview_sent:
+                    preview_sent = True
+                    stage_seconds.observe(time.perf_counter() - started, stage='preview_wait')
+                    try:
+                        preview_bytes, _ = await self.download_result(status_data.get('preview_thumbnail_url',
+                                                                                      status_data['preview_url']))
+                    except httpx.HTTPError as e:
+                        # The preview is only a courtesy; the final result is still on its way.
+                        logging.warning("Preview for task %s is unavailable: %s", task_id, e)
+                    else:
+                        with stage_seconds.time(stage='reply'):
+                            await update.message.reply_photo(photo=preview_bytes,
+                                                             caption="⚡ Быстрый предпросмотр. Полное качество ещё обрабатывается...")
+
+                if 'items' in status_data:
+                    finished = sum(item['status'] in ('completed', 'error') for item in status_data['items'])
+                    if finished > finished_items and status_data['status'] not in ('completed', 'error'):
+                        await self.send_message(update, f"⏳ Готово {finished} из {len(status_data['items'])}...")
+                    finished_items = finished
+
+                if status_data['status'] in ('completed', 'error'):
+                    stage_seconds.observe(time.perf_counter() - started, stage='poll_wait')
+
+                if status_data['status'] == 'completed':
+                    if 'items' in status_data:
+                        await self.send_batch_results(update, status_data['items'],
+                                                      context.user_data.get('batch_products', {}))
+                    else:
+                        img_bytes, img_digest = await self.download_result(status_data['result_url'])
+                        with stage_seconds.time(stage='reply'):
+                            await self.reply_cached_photo(update.message, f"result:{img_digest}", img_digest, img_bytes)
+                    await asyncio.sleep(3)
+                    await self.send_message(update, "✅ Status: Обработка завершена!")
+                    await self.show_catalog(update, context)
+                    processing = False
+
+                elif status_data['status'] == 'error':
+                    await self.send_message(update, "❌ Status: Ошибка на стороне IDM-VTON API. Повторите позже.")
+                    await asyncio.sleep(3)
+                    await self.show_catalog(update, context)
+                    processing = False
+                elif (status_data['status'], status_data.get('position')) != last_progress:
+                    last_progress = (status_data['status'], status_data.get('position'))
+                    if status_data['status'] == 'queued':
+                        await self.send_message(update, f"⏳ Status: в очереди, позиция {status_data.get('position')}...")
                     else:
                         await self.send_message(update, "⏳ Status: в обоработке...")
 
-            except httpx.RequestError as e:
+            except (httpx.RequestError, StatusUnavailableError) as e:
+                failing_since = failing_since or time.monotonic()
+                if time.monotonic() - failing_since < POLL_RETRY_WINDOW:
+                    logging.warning(f"Status of task {task_id} is unavailable, retrying: {e}")
+                    await asyncio.sleep(delay)
+                    delay = min(delay * POLL_BACKOFF_FACTOR, POLL_MAX_DELAY)
+                    continue
                 logging.error(f"Request error while checking status for task {task_id}: {e}")
                 await self.send_message(update, "❌ Status: Ошибка при получении статуса. Повторите позже.")
                 processing = False
@@ -179,15 +433,44 @@ class TelegramHandler:
                 await self.send_message(update, "❌ Status: Неизвестная ошибка. Повторите позже.")
                 processing = False
         
-    async def show_catalog(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-        """Displays the current product from the catalog to the user."""
-        current_index = context.user_data.get('current_product_index', 0)
+    async def download_result(self, url: str) -> tuple[bytes, str]:
+        """Downloads a result image from a complete URL linked from a status response and returns its bytes with the server's content hash."""
+        with stage_seconds.time(stage='result_download'):
+            response = await self.http_client.get(f"{self.base_url_api}{url}")
+        response.raise_for_status()
+        digest = response.headers.get('etag', '').strip('"') or hashlib.sha256(response.content).hexdigest()
+        return response.content, digest
+
+    async def send_batch_results(self, update: Update, items: list[dict], product_names: dict[int, str]) -> None:
+        """Downloads the results of a batch try-on concurrently, sends them as one media group and lists the products that failed."""
+        completed = [item for item in items if item.get('result_url')]
+        downloads = await asyncio.gather(*(self.download_result(item['result_url']) for item in completed),
+                                         return_exceptions=True)
+        media = []
+        failed = [product_names.get(item['product_id'], str(item['product_id'])) for item in items if not item.get('result_url')]
+        for item, download in zip(completed, downloads):
+            if isinstance(download, Exception):
+                logging.error("Failed to download the result of product %s: %s", item['product_id'], download)
+                failed.append(product_names.get(item['product_id'], str(item['product_id'])))
+            else:
+                media.append(InputMediaPhoto(media=download[0], caption=product_names.get(item['product_id'])))
 
-        if current_index < 0 or current_index >= len(self.products):
+        with stage_seconds.time(stage='reply'):
+            if len(media) == 1:
+                await update.message.reply_photo(photo=media[0].media, caption=media[0].caption)
+            elif media:
+                await update.message.reply_media_group(media=media)
+
+        if failed:
+            await self.send_message(update, "❌ Не удалось примерить: " + ", ".join(failed))
+
+    async def show_catalog(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Displays the current product from the catalog or from the user's search results."""
+        product = await self.current_product(context)
+        if product is None:
             await self.send_message(update, "❌ Продукт не найден.")
             return
 
-        product = self.products[current_index]
         product_text = (
             f"🛍️ *Название:* {escape_special_chars(product.name)}\n"
             f"🆔 *Модель:* {escape_special_chars(product.model)}\n"
@@ -197,20 +480,28 @@ class TelegramHandler:
         
         keyboard = self.get_product_keyboard()
 
-        if update.callback_query and update.callback_query.message:
-            await update.callback_query.message.reply_photo(
-                photo=product.image_url,
-                caption=product_text,
-                reply_markup=keyboard,
-                parse_mode=ParseMode.MARKDOWN_V2
-            )
-        else:
-            await update.message.reply_photo(
-                photo=product.image_url,
-                caption=product_text,
-                reply_markup=keyboard,
-                parse_mode=ParseMode.MARKDOWN_V2
-            )
+        message = update.callback_query.message if update.callback_query and update.callback_query.message else update.message
+        await self.reply_cached_photo(
+            message, f"product:{product.id}", product.image_url, product.image_url,
+            caption=product_text,
+            reply_markup=keyboard,
+            parse_mode=ParseMode.MARKDOWN_V2
+        )
+
+    async def reply_cached_photo(self, message, key: str, source: str, photo, **kwargs):
+        """Replies with a photo, reusing the Telegram file_id recorded for the key while its source is unchanged."""
+        file_id = self.file_id_cache.get(key, source)
+        if file_id is not None:
+            try:
+                return await message.reply_photo(photo=file_id, **kwargs)
+            except BadRequest as e:
+                logging.warning("Cached file_id for %s was rejected, sending the original: %s", key, e)
+                self.file_id_cache.delete(key)
+
+        sent_message = await message.reply_photo(photo=photo, **kwargs)
+        if sent_message.photo:
+            self.file_id_cache.set(key, source, sent_message.photo[-1].file_id)
+        return sent_message
 
     def get_product_keyboard(self):
         """Creates and returns the inline keyboard for product navigation in the Telegram bot."""
@@ -218,32 +509,83 @@ class TelegramHandler:
             [InlineKeyboardButton("◀️ Назад", callback_data='previous_product'),
              InlineKeyboardButton("▶️ Вперед", callback_data='next_product')],
             [InlineKeyboardButton("✅ *Выбрать*", callback_data='select_product'),
-             InlineKeyboardButton("🔙 В меню", callback_data='return_to_menu')]
+             InlineKeyboardButton("🔙 В меню", callback_data='return_to_menu')],
+            [InlineKeyboardButton("➕ В подборку", callback_data='toggle_batch'),
+             InlineKeyboardButton("🧺 Примерить подборку", callback_data='select_batch')]
         ]
         return InlineKeyboardMarkup(keyboard)
 
     async def next_product(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Advances the current product index to the next product in the list and displays it."""
-        context.user_data['current_product_index'] = (context.user_data['current_product_index'] + 1) % len(self.products)
+        context.user_data['current_product_index'] = (context.user_data.get('current_product_index', 0) + 1) % max(context.user_data.get('catalog_total', 0), 1)
         await self.show_catalog(update, context)
 
     async def previous_product(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Moves the current product index to the previous product in the list and displays it."""
-        context.user_data['current_product_index'] = (context.user_data['current_product_index'] - 1) % len(self.products)
+        context.user_data['current_product_index'] = (context.user_data.get('current_product_index', 0) - 1) % max(context.user_data.get('catalog_total', 0), 1)
         await self.show_catalog(update, context)
 
     async def select_product(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Selects the current product and prompts the user to send a photo for processing."""
-        product = self.products[context.user_data['current_product_index']]
-        await self.send_message(update, f"✅ Вы выбрали: {product.name}.\n*Теперь отправьте фото в jpeg/jpg/png*")
+        product = await self.current_product(context)
+        if product is None:
+            await self.send_message(update, "❌ Продукт не найден.")
+            return
+        context.user_data['batch_mode'] = False
+        await self.send_message(update, f"✅ Вы выбрали: {product.name}.\nВыберите качество обработки:",
+                                self.get_quality_keyboard())
+
+    async def toggle_batch(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Adds the current product to the user's try-on selection, or removes it if it is already there."""
+        product = await self.current_product(context)
+        if product is None:
+            await self.send_message(update, "❌ Продукт не найден.")
+            return
+        # Product id -> name, so that the selection can be shown without fetching the products again.
+        batch_products = context.user_data.setdefault('batch_products', {})
+        if product.id in batch_products:
+            del batch_products[product.id]
+            await self.send_message(update, f"➖ {product.name} убран из подборки ({len(batch_products)}).")
+        elif len(batch_products) >= BATCH_MAX_ITEMS:
+            await self.send_message(update, f"❌ В подборке может быть не больше {BATCH_MAX_ITEMS} товаров.")
+        else:
+            batch_products[product.id] = product.name
+            await self.send_message(update, f"➕ {product.name} добавлен в подборку ({len(batch_products)}).")
+
+    async def select_batch(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Selects the whole try-on selection and prompts the user to choose the quality and send a photo."""
+        selected = list(context.user_data.get('batch_products', {}).values())
+        if not selected:
+            await self.send_message(update, "❌ Подборка пуста. Добавьте товары кнопкой «➕ В подборку».")
+            return
+        context.user_data['batch_mode'] = True
+        await self.send_message(update, "🧺 Подборка:\n" + "\n".join(selected) + "\nВыберите качество обработки:",
+                                self.get_quality_keyboard())
+
+    def get_quality_keyboard(self):
+        """Creates and returns the inline keyboard for choosing the processing quality."""
+        keyboard = [
+            [InlineKeyboardButton("⚡ Быстрый просмотр", callback_data='quality_preview')],
+            [InlineKeyboardButton("💎 Полное качество", callback_data='quality_full')],
+            [InlineKeyboardButton("⚡➡💎 Сначала превью, затем полное", callback_data='quality_progressive')]
+        ]
+        return InlineKeyboardMarkup(keyboard)
+
+    async def set_quality(self, update: Update, context: ContextTypes.DEFAULT_TYPE, mode: str):
+        """Remembers the chosen quality mode and prompts the user to send a photo for processing."""
+        context.user_data['quality_mode'] = mode
+        await self.send_message(update, "*Теперь отправьте фото в jpeg/jpg/png*")
 
     async def handle_button_click(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Handles button click events from the inline keyboard and routes to the appropriate command."""
         query = update.callback_query.data
         await update.callback_query.answer()
 
-        command = self.command_map.get(query)
-        if command:
-            await command(update, context)
+        name, separator, argument = query.partition(':')
+        if separator and argument.isdecimal() and name in self.parameterised_command_map:
+            await self.parameterised_command_map[name](update, context, int(argument))
+        elif not separator and query in self.command_map:
+            await self.command_map[query](update, context)
         else:
+            handler_calls_total.inc(handler='unknown')
             await self.send_message(update, "❌ Неизвестная команда.")
\ No newline at end of file
@@ -0,0 +1,15 @@
+import io
+from PIL import Image, ImageOps
+
+def downscale_photo(image_bytes: bytes, max_side: int, jpeg_quality: int) -> bytes | None:
+    """Fix EXIF orientation and downscale a photo to max_side as JPEG; return None if it already fits."""
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        if image.format == 'JPEG' and max(image.size) <= max_side and image.getexif().get(0x0112, 1) == 1:
+            return None
+        image = ImageOps.exif_transpose(image)
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+        output = io.BytesIO()
+        image.save(output, format='JPEG', quality=jpeg_quality, optimize=True)
+    return output.getvalue()
\ No newline at end of file
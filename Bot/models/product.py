@@ -1,6 +1,8 @@
 class Product:
     """Class representing a product."""
-    
+
+    __slots__ = ('id', 'name', 'image_url', 'description', 'model', 'color')
+
     def __init__(self, id: int, name: str, image_url: str, description: str, model: str, color: str) -> None:
         self.id: int = id
         self.name: str = name
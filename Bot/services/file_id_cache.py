@@ -0,0 +1,36 @@
+import sqlite3
+import threading
+
+class FileIdCache:
+    """Persistent map from an image key to the Telegram file_id returned for it, tied to the image source."""
+
+    def __init__(self, path: str) -> None:
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS file_ids (key TEXT PRIMARY KEY, source TEXT NOT NULL, file_id TEXT NOT NULL)"
+        )
+
+    def get(self, key: str, source: str) -> str | None:
+        """Return the cached file_id for a key, or None if it is missing or was recorded for a different source."""
+        with self._lock:
+            row = self._connection.execute("SELECT source, file_id FROM file_ids WHERE key = ?", (key,)).fetchone()
+        if row is None or row[0] != source:
+            return None
+        return row[1]
+
+    def set(self, key: str, source: str, file_id: str) -> None:
+        """Record the file_id Telegram returned after sending the image from source."""
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO file_ids (key, source, file_id) VALUES (?, ?, ?)", (key, source, file_id)
+            )
+
+    def delete(self, key: str) -> None:
+        """Forget the file_id for a key, e.g. after Telegram rejected it."""
+        with self._lock:
+            self._connection.execute("DELETE FROM file_ids WHERE key = ?", (key,))
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
\ No newline at end of file
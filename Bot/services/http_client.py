@@ -0,0 +1,9 @@
+import importlib.util
+import httpx
+
+def create_http_client(max_connections: int, timeout: float) -> httpx.AsyncClient:
+    """Create the long-lived connection pool shared by the bot services, using HTTP/2 when h2 is installed."""
+    http2 = importlib.util.find_spec("h2") is not None
+    limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+    # The pool timeout bounds how long a request waits for a free connection when every one is busy, e.g. long-polling.
+    return httpx.AsyncClient(http2=http2, limits=limits, timeout=httpx.Timeout(timeout, connect=10.0))
\ No newline at end of file
@@ -1,20 +1,64 @@
+import time
 import httpx
 import logging
+from collections import OrderedDict
 from models.product import Product
 
+class ProductPage:
+    """One page of the catalog or of its search results, with the number of matching products."""
+
+    def __init__(self, products: tuple[Product, ...], total: int, offset: int) -> None:
+        self.products: tuple[Product, ...] = products
+        self.total: int = total
+        self.offset: int = offset
+
 class ProductService:
     """Service for managing products."""
-    
-    def __init__(self, base_url: str) -> None:
+
+    def __init__(self, base_url: str, client: httpx.AsyncClient, max_age: float = 300.0, max_pages: int = 256) -> None:
         self.base_url: str = base_url
+        self.client: httpx.AsyncClient = client
+        self.max_age: float = max_age
+        self.max_pages: int = max_pages
+        # (offset, limit, query) -> (fetched_at, etag, page), least recently used first.
+        self._pages: OrderedDict[tuple, tuple[float, str | None, ProductPage]] = OrderedDict()
 
-    async def fetch_products(self) -> list[Product]:
-        """Fetch products from the API and return them as a list of Product objects."""
+    async def get_page(self, offset: int, limit: int, query: str | None = None) -> ProductPage | None:
+        """Return a page of the catalog, or of the products matching a search query, revalidating a cached page with a conditional request once it is older than max_age."""
+        key = (offset, limit, query)
+        cached = self._pages.get(key)
+        if cached is not None:
+            self._pages.move_to_end(key)
+            if time.monotonic() - cached[0] < self.max_age:
+                return cached[2]
+
+        params = {'offset': offset, 'limit': limit}
+        if query:
+            params['q'] = query
+        headers = {'If-None-Match': cached[1]} if cached is not None and cached[1] else {}
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(f"{self.base_url}/products/")
+            response = await self.client.get(f"{self.base_url}/products/", params=params, headers=headers)
+            if response.status_code == 304 and cached is not None:
+                page = cached[2]
+            else:
                 response.raise_for_status()
-                return [Product(**item) for item in response.json()]
+                items = response.json()
+                page = ProductPage(tuple(Product(**item) for item in items),
+                                   int(response.headers.get('X-Total-Count', offset + len(items))), offset)
         except Exception as e:
             logging.error("Error fetching products from API: %s", e)
-            return []
\ No newline at end of file
+            return cached[2] if cached is not None else None
+
+        self._pages[key] = (time.monotonic(), response.headers.get('ETag'), page)
+        self._pages.move_to_end(key)
+        while len(self._pages) > self.max_pages:
+            self._pages.popitem(last=False)
+        return page
+
+    async def get_product(self, index: int, page_size: int, query: str | None = None) -> tuple[Product | None, int]:
+        """Return the product at a position of the catalog or of a search result, fetching the page that holds it, and the number of matching products."""
+        page = await self.get_page(index - index % page_size, page_size, query)
+        if page is None:
+            return None, 0
+        position = index - page.offset
+        return (page.products[position] if 0 <= position < len(page.products) else None), page.total
\ No newline at end of file
@@ -1,42 +1,83 @@
 import httpx
 import logging
-import base64
+import mimetypes
+from typing import BinaryIO
 
 class UploadService:
     """Service for handling file uploads."""
     
-    def __init__(self, upload_url: str) -> None:
+    def __init__(self, upload_url: str, client: httpx.AsyncClient, batch_upload_url: str | None = None) -> None:
         self.upload_url: str = upload_url
+        self.client: httpx.AsyncClient = client
+        self.batch_upload_url: str | None = batch_upload_url
     
-    async def upload_files(self, user_photo_base64: str, user_photo_extension: str, product_image_base64: str, 
+    async def upload_files(self, user_photo: bytes | BinaryIO, user_photo_extension: str, product_image: bytes | BinaryIO, 
                            product_image_extension: str, product_info: dict) -> dict:
-        """Upload user photo and product image to the server and return the response."""
+        """Upload user photo and product image to the server as multipart files and return the response."""
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(self.upload_url, data={
-                    "user_photo": user_photo_base64,
-                    "user_photo_extension": user_photo_extension,
-                    "product_image": product_image_base64,
-                    "product_image_extension": product_image_extension,
-                    **product_info
-                })
-                response.raise_for_status()
-                return response.json()
+            response = await self.client.post(self.upload_url, data=product_info, files={
+                "user_photo": self._file_part("user_photo", user_photo_extension, user_photo),
+                "product_image": self._file_part("product_image", product_image_extension, product_image),
+            })
+            response.raise_for_status()
+            return response.json()
         except httpx.HTTPStatusError as e:
             logging.error(f"HTTP error occurred: {e.response.status_code} - {e.response.text}")
             raise
         except Exception as e:
             logging.error(f"An error occurred while uploading files: {e}")
             raise 
+
+    async def upload_for_product(self, user_photo: bytes | BinaryIO, user_photo_extension: str, product_id: int,
+                                 user_id: int, quality: str = "full", progressive: bool = False) -> dict:
+        """Upload the user photo with a catalog product id, letting the server use its stored garment image."""
+        try:
+            response = await self.client.post(self.upload_url, data={
+                "product_id": product_id, "user_id": user_id, "quality": quality, "progressive": progressive
+            }, files={
+                "user_photo": self._file_part("user_photo", user_photo_extension, user_photo),
+            })
+            response.raise_for_status()
+            return response.json()
+        except httpx.HTTPStatusError as e:
+            logging.error(f"HTTP error occurred: {e.response.status_code} - {e.response.text}")
+            raise
+        except Exception as e:
+            logging.error(f"An error occurred while uploading files: {e}")
+            raise 
+
+    async def upload_batch(self, user_photo: bytes | BinaryIO, user_photo_extension: str, product_ids: list[int],
+                           user_id: int, quality: str = "full") -> dict:
+        """Upload the user photo once with several catalog product ids to try them all on in a single task."""
+        try:
+            response = await self.client.post(self.batch_upload_url, data={
+                "product_ids": product_ids, "user_id": user_id, "quality": quality
+            }, files={
+                "user_photo": self._file_part("user_photo", user_photo_extension, user_photo),
+            })
+            response.raise_for_status()
+            return response.json()
+        except httpx.HTTPStatusError as e:
+            logging.error(f"HTTP error occurred: {e.response.status_code} - {e.response.text}")
+            raise
+        except Exception as e:
+            logging.error(f"An error occurred while uploading files: {e}")
+            raise 
+
+    @staticmethod
+    def _file_part(name: str, extension: str, content: bytes | BinaryIO) -> tuple:
+        """Build an httpx multipart file tuple with a content type guessed from the extension."""
+        filename = f"{name}{extension}"
+        content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        return filename, content, content_type
     
-    async def fetch_product_image(self, product_image_url: str) -> str:
-        """Fetch product image from the given URL and return it as a base64 string."""
+    async def fetch_product_image(self, product_image_url: str) -> bytes:
+        """Fetch product image from the given URL and return its raw bytes."""
         try:
-            async with httpx.AsyncClient() as client:
-                product_image_response = await client.get(product_image_url)
-                product_image_response.raise_for_status()
-                product_image_bytes = product_image_response.content
-                return product_image_bytes
+            product_image_response = await self.client.get(product_image_url)
+            product_image_response.raise_for_status()
+            product_image_bytes = product_image_response.content
+            return product_image_bytes
         except httpx.HTTPStatusError as e:
             logging.error(f"Failed to fetch product image: {e.response.status_code} - {e.response.text}")
             raise  
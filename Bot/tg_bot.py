@@ -1,7 +1,12 @@
-from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, CallbackQueryHandler, filters
+import asyncio
+import logging
+from telegram.ext import Application, ApplicationBuilder, CommandHandler, MessageHandler, CallbackQueryHandler, filters
 from config import Config
 from logger import setup_logger
-from handlers.telegram_handler import TelegramHandler
+from handlers.telegram_handler import TelegramHandler, instrument
+from services.file_id_cache import FileIdCache
+from services.http_client import create_http_client
+from services.metrics import registry, serve_metrics
 from services.product_service import ProductService
 from services.upload_service import UploadService
 
@@ -11,18 +16,49 @@ def main() -> None:
     setup_logger()
     config = Config()
 
-    application = ApplicationBuilder().token(config.telegram_bot_token).build()
+    http_client = create_http_client(max_connections=config.http_max_connections,
+                                     timeout=config.http_timeout)
 
-    product_service = ProductService(config.api_base_url)  
-    upload_service = UploadService(config.fastapi_upload_url)
+    product_service = ProductService(config.api_base_url, http_client, max_age=config.catalog_refresh_interval)
+    upload_service = UploadService(config.fastapi_upload_url, http_client, config.fastapi_batch_upload_url)
+    file_id_cache = FileIdCache(config.file_id_cache_path)
+    metrics_servers: list[asyncio.AbstractServer] = []
+
+    async def on_startup(application: Application) -> None:
+        """Start serving /metrics once the bot is running, if a metrics port is configured."""
+        if config.metrics_port:
+            try:
+                metrics_servers.append(await serve_metrics(registry, config.metrics_host, config.metrics_port))
+            except OSError as e:
+                # Metrics are optional; a busy port must not keep the bot from answering users.
+                logging.warning("Failed to serve metrics on %s:%s: %s", config.metrics_host, config.metrics_port, e)
+
+    async def on_shutdown(application: Application) -> None:
+        """Stop the metrics server and close the shared connection pool and caches when the bot shuts down."""
+        for server in metrics_servers:
+            server.close()
+            await server.wait_closed()
+        await http_client.aclose()
+        file_id_cache.close()
+
+    # Updates are handled concurrently so that one user's long try-on does not block everyone else.
+    application = (ApplicationBuilder().token(config.telegram_bot_token)
+                   .concurrent_updates(config.concurrent_updates)
+                   .post_init(on_startup).post_shutdown(on_shutdown).build())
     
     telegram_handler = TelegramHandler(product_service=product_service, 
                                        upload_service=upload_service, 
-                                       base_url_api=config.api_base_url)
+                                       base_url_api=config.api_base_url,
+                                       http_client=http_client,
+                                       file_id_cache=file_id_cache,
+                                       photo_max_side=config.photo_max_side,
+                                       photo_jpeg_quality=config.photo_jpeg_quality,
+                                       max_jobs_per_user=config.max_jobs_per_user)
 
-    application.add_handler(CommandHandler("start", telegram_handler.start_menu))
-    application.add_handler(CommandHandler("help", telegram_handler.help_command))
-    application.add_handler(MessageHandler(filters.PHOTO, telegram_handler.handle_photo))
+    application.add_handler(CommandHandler("start", instrument("start_command", telegram_handler.start_menu)))
+    application.add_handler(CommandHandler("help", instrument("help_command", telegram_handler.help_command)))
+    application.add_handler(CommandHandler("search", instrument("search_command", telegram_handler.search_command)))
+    application.add_handler(MessageHandler(filters.PHOTO, instrument("photo", telegram_handler.handle_photo)))
     application.add_handler(CallbackQueryHandler(telegram_handler.handle_button_click))
 
     application.run_polling()
@@ -0,0 +1,408 @@
+import argparse
+import asyncio
+import base64
+import functools
+import http.server
+import io
+import json
+import logging
+import math
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+import httpx
+from PIL import Image
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BOT_DIR = os.path.join(os.path.dirname(BASE_DIR), 'Bot')
+API_BASE_URL = "http://bench"
+DISK_SAMPLE_INTERVAL = 0.5
+FINAL_STATUSES = ('completed', 'error')
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Offline load test of the try-on server and bot against a local /tryon stand-in.")
+    parser.add_argument("--scenario", choices=("server", "bot", "all"), default="server",
+                        help="drive the HTTP API directly, replay TelegramHandler flows, or both")
+    parser.add_argument("--users", type=int, default=20, help="concurrent synthetic users")
+    parser.add_argument("--requests", type=int, default=3, help="try-ons per user")
+    parser.add_argument("--upload", choices=("product", "files", "base64"), default="product",
+                        help="upload by catalog product id, as multipart files, or via the legacy base64 /upload/")
+    parser.add_argument("--latency", type=float, default=0.5, help="mean /tryon latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.2, help="uniform /tryon latency jitter in seconds")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="probability that a /tryon call fails")
+    parser.add_argument("--backends", type=int, default=1, help="number of fake inference backends")
+    parser.add_argument("--products", type=int, default=5, help="number of products in the synthetic catalog")
+    parser.add_argument("--repeat-photos", action="store_true", help="reuse one photo per user so the result cache is hit")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", dest="json_path", help="also write the report as JSON to this path")
+    parser.add_argument("--max-p95", type=float, help="exit with status 1 if any p95 latency exceeds this many seconds")
+    parser.add_argument("--max-error-rate", type=float, help="exit with status 1 if any error rate exceeds this fraction")
+    parser.add_argument("--verbose", action="store_true", help="keep the server's INFO logging")
+    return parser.parse_args()
+
+def percentile(values: list[float], pct: float) -> float | None:
+    """Nearest-rank percentile of a list of samples, or None if it is empty."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+def directory_size(paths: list[str]) -> int:
+    """Total size in bytes of the regular files below the given paths."""
+    total = 0
+    for path in paths:
+        for root, _, files in os.walk(path):
+            for name in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    pass
+    return total
+
+def peak_rss() -> dict:
+    """Peak resident set size in bytes of this process and of its reaped children, where the platform reports it."""
+    try:
+        import resource
+    except ImportError:
+        return {"self": None, "children": None}
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    scale = 1 if sys.platform == "darwin" else 1024
+    return {"self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+            "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale}
+
+def make_image(width: int, height: int, seed: int, fmt: str) -> bytes:
+    """Encode a synthetic image whose pixels depend on the seed, so that every seed hashes differently."""
+    rng = random.Random(seed)
+    image = Image.new('RGB', (width, height), tuple(rng.randrange(256) for _ in range(3)))
+    image.paste(tuple(rng.randrange(256) for _ in range(3)), (0, 0, width // 4, height // 4))
+    image.putpixel((0, 0), (seed % 256, seed // 256 % 256, seed // 65536 % 256))
+    output = io.BytesIO()
+    image.save(output, format=fmt)
+    return output.getvalue()
+
+def start_garment_server(directory: str, product_count: int) -> tuple[http.server.ThreadingHTTPServer, str]:
+    """Serve synthetic garment images from a local HTTP server and return it with its base URL."""
+    for product_id in range(1, product_count + 1):
+        with open(os.path.join(directory, f"garment_{product_id}.png"), "wb") as f:
+            f.write(make_image(384, 512, 100000 + product_id, 'PNG'))
+
+    class QuietHandler(http.server.SimpleHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(QuietHandler, directory=directory))
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd, f"http://127.0.0.1:{httpd.server_address[1]}"
+
+def write_catalog(path: str, garment_base_url: str, product_count: int) -> list[dict]:
+    products = [{
+        "id": product_id,
+        "name": f"Bench product {product_id}",
+        "image_url": f"{garment_base_url}/garment_{product_id}.png",
+        "description": f"Synthetic garment number {product_id}",
+        "model": f"BENCH-{product_id}",
+        "color": "mixed",
+    } for product_id in range(1, product_count + 1)]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(products, f)
+    return products
+
+def configure_environment(args: argparse.Namespace, workdir: str) -> None:
+    """Point the server at the synthetic catalog, a scratch data directory and fake /tryon backends; must run before importing server."""
+    query = f"latency={args.latency}&jitter={args.jitter}&failure_rate={args.failure_rate}"
+    os.environ["MODEL_NAMES"] = ",".join(f"fake?{query}&seed={args.seed + i}" for i in range(args.backends))
+    os.environ["JSON_DATA_URL"] = os.path.join(workdir, "catalog.json")
+    os.environ["DATA_DIR"] = os.path.join(workdir, "data")
+    os.environ["TASK_STORE"] = "memory"
+    os.environ.setdefault("HT_TOKEN", "benchmark")
+
+class Recorder:
+    """Collects the outcome and end-to-end latency of every synthetic request in one scenario."""
+
+    def __init__(self) -> None:
+        self.latencies: list[float] = []
+        self.completed: int = 0
+        self.errors: int = 0
+        self.rejected: int = 0
+        self.started: float = time.perf_counter()
+        self.finished: float | None = None
+
+    def report(self) -> dict:
+        duration = (self.finished or time.perf_counter()) - self.started
+        total = self.completed + self.errors + self.rejected
+        return {
+            "requests": total,
+            "completed": self.completed,
+            "errors": self.errors,
+            "rejected": self.rejected,
+            "error_rate": (self.errors + self.rejected) / total if total else 0.0,
+            "duration_seconds": duration,
+            "throughput_per_second": self.completed / duration if duration else 0.0,
+            "latency_p50": percentile(self.latencies, 50),
+            "latency_p95": percentile(self.latencies, 95),
+            "latency_p99": percentile(self.latencies, 99),
+        }
+
+async def wait_for_task(client: httpx.AsyncClient, task_id: str) -> dict:
+    while True:
+        response = await client.get(f"/status/{task_id}/wait", params={"timeout": 25})
+        status = response.json()
+        if status.get("status") in FINAL_STATUSES or response.status_code == 404:
+            return status
+
+async def run_server_user(client: httpx.AsyncClient, args: argparse.Namespace, user_index: int,
+                          products: list[dict], garments: dict[int, bytes], recorder: Recorder) -> None:
+    """One synthetic user uploading photos one after another and waiting for each result."""
+    rng = random.Random(args.seed * 1000003 + user_index)
+    for request_index in range(args.requests):
+        photo_seed = user_index if args.repeat_photos else user_index * args.requests + request_index
+        photo = make_image(768, 1024, photo_seed, 'JPEG')
+        product = rng.choice(products)
+        started = time.perf_counter()
+        if args.upload == "product":
+            response = await client.post("/upload/files/", data={"product_id": product["id"], "user_id": str(user_index)},
+                                         files={"user_photo": ("user_photo.jpg", photo, "image/jpeg")})
+        elif args.upload == "files":
+            response = await client.post("/upload/files/", data={"product_description": product["description"],
+                                                                 "user_id": str(user_index)},
+                                         files={"user_photo": ("user_photo.jpg", photo, "image/jpeg"),
+                                                "product_image": ("product_image.png", garments[product["id"]], "image/png")})
+        else:
+            response = await client.post("/upload/", data={
+                "user_photo": base64.b64encode(photo).decode(), "user_photo_extension": ".jpg",
+                "product_image": base64.b64encode(garments[product["id"]]).decode(), "product_image_extension": ".png",
+                "product_description": product["description"], "user_id": str(user_index)})
+
+        if response.status_code in (429, 503):
+            recorder.rejected += 1
+            await asyncio.sleep(rng.uniform(0.5, 1.5))
+            continue
+        if response.status_code != 200:
+            recorder.errors += 1
+            continue
+
+        status = await wait_for_task(client, response.json()["task_id"])
+        if status.get("status") == "completed" and (await client.get(status["result_url"])).status_code == 200:
+            recorder.completed += 1
+            recorder.latencies.append(time.perf_counter() - started)
+        else:
+            recorder.errors += 1
+
+class FakeFile:
+    """Stand-in for telegram.File that serves a photo from memory."""
+
+    def __init__(self, content: bytes) -> None:
+        self.file_path = "photos/file.jpg"
+        self._content = content
+
+    async def download_to_memory(self, out) -> None:
+        out.write(self._content)
+
+class FakePhotoSize:
+    def __init__(self, file_id: str, content: bytes = b"") -> None:
+        self.file_id = file_id
+        self._content = content
+
+    async def get_file(self) -> FakeFile:
+        return FakeFile(self._content)
+
+class FakeMessage:
+    """Stand-in for telegram.Message that records every reply instead of sending it to Telegram."""
+
+    def __init__(self, sent: list[tuple[str, str | None]], photo: bytes | None = None) -> None:
+        self.sent = sent
+        self.photo = [FakePhotoSize("incoming", photo)] if photo is not None else []
+
+    def _sent_photo(self) -> "FakeMessage":
+        message = FakeMessage(self.sent)
+        message.photo = [FakePhotoSize(f"file-{len(self.sent)}")]
+        return message
+
+    async def reply_text(self, text: str, **kwargs) -> "FakeMessage":
+        self.sent.append(("text", text))
+        return FakeMessage(self.sent)
+
+    async def reply_photo(self, photo, caption: str | None = None, **kwargs) -> "FakeMessage":
+        self.sent.append(("photo", caption))
+        return self._sent_photo()
+
+    async def reply_media_group(self, media, **kwargs) -> list["FakeMessage"]:
+        self.sent.append(("media_group", str(len(media))))
+        return [self._sent_photo() for _ in media]
+
+class FakeCallbackQuery:
+    def __init__(self, data: str, message: FakeMessage) -> None:
+        self.data = data
+        self.message = message
+
+    async def answer(self) -> None:
+        pass
+
+def fake_update(user_id: int, sent: list, callback_data: str | None = None, photo: bytes | None = None) -> SimpleNamespace:
+    """Build a minimal telegram.Update for a command, a button press or an incoming photo."""
+    message = FakeMessage(sent, photo)
+    callback_query = FakeCallbackQuery(callback_data, message) if callback_data is not None else None
+    return SimpleNamespace(message=message, callback_query=callback_query,
+                           effective_user=SimpleNamespace(id=user_id))
+
+async def run_bot_user(handler, args: argparse.Namespace, user_index: int, recorder: Recorder,
+                       telegram_calls: list[int]) -> None:
+    """Replay /start, catalog browsing, product and quality selection and a photo upload through TelegramHandler."""
+    context = SimpleNamespace(user_data={})
+    for request_index in range(args.requests):
+        sent: list[tuple[str, str | None]] = []
+        photo_seed = 500000 + (user_index if args.repeat_photos else user_index * args.requests + request_index)
+        await handler.start_menu(fake_update(user_index, sent), context)
+        for button in ('show_catalog', 'next_product', 'select_product', 'quality_full'):
+            await handler.handle_button_click(fake_update(user_index, sent, callback_data=button), context)
+        started = time.perf_counter()
+        await handler.handle_photo(fake_update(user_index, sent, photo=make_image(768, 1024, photo_seed, 'JPEG')),
+                                   context)
+        telegram_calls.append(len(sent))
+
+        texts = [text for kind, text in sent if kind == "text"]
+        if any(text.startswith("⏳ Сервер перегружен") or text.startswith("⏳ У вас уже") for text in texts):
+            recorder.rejected += 1
+        elif any(text.startswith("❌") for text in texts):
+            recorder.errors += 1
+        else:
+            recorder.completed += 1
+            recorder.latencies.append(time.perf_counter() - started)
+
+async def sample_disk(paths: list[str], peak: list[int]) -> None:
+    while True:
+        peak[0] = max(peak[0], await asyncio.to_thread(directory_size, paths))
+        await asyncio.sleep(DISK_SAMPLE_INTERVAL)
+
+async def run(args: argparse.Namespace, workdir: str, garment_base_url: str, products: list[dict]) -> dict:
+    import server
+
+    garments = {}
+    for product in products:
+        with open(os.path.join(workdir, "garments", f"garment_{product['id']}.png"), "rb") as f:
+            garments[product["id"]] = f.read()
+
+    data_paths = [server.DATA_DIR]
+    disk_peak = [0]
+    report = {"config": {key: value for key, value in vars(args).items() if key != "json_path"}}
+
+    transport = httpx.ASGITransport(app=server.app)
+    async with server.lifespan(server.app):
+        sampler = asyncio.create_task(sample_disk(data_paths, disk_peak))
+        async with httpx.AsyncClient(transport=transport, base_url=API_BASE_URL, timeout=60) as client:
+            if args.scenario in ("server", "all"):
+                recorder = Recorder()
+                await asyncio.gather(*(run_server_user(client, args, user_index, products, garments, recorder)
+                                       for user_index in range(args.users)))
+                recorder.finished = time.perf_counter()
+                report["server"] = recorder.report()
+
+            if args.scenario in ("bot", "all"):
+                sys.path.append(BOT_DIR)
+                from handlers.telegram_handler import TelegramHandler
+                from services.file_id_cache import FileIdCache
+                from services.product_service import ProductService
+                from services.upload_service import UploadService
+
+                file_id_cache = FileIdCache(os.path.join(workdir, "file_ids.db"))
+                product_service = ProductService(API_BASE_URL, client)
+                handler = TelegramHandler(product_service,
+                                          UploadService(f"{API_BASE_URL}/upload/files/", client,
+                                                        f"{API_BASE_URL}/upload/batch/"),
+                                          API_BASE_URL, client, file_id_cache, photo_max_side=1024)
+                recorder = Recorder()
+                telegram_calls: list[int] = []
+                await asyncio.gather(*(run_bot_user(handler, args, user_index, recorder, telegram_calls)
+                                       for user_index in range(args.users)))
+                recorder.finished = time.perf_counter()
+                file_id_cache.close()
+                report["bot"] = {**recorder.report(),
+                                 "telegram_calls_per_flow": sum(telegram_calls) / len(telegram_calls) if telegram_calls else 0.0}
+
+            report["backends"] = (await client.get("/backends/")).json()
+            report["cache"] = (await client.get("/cache/stats/")).json()
+            report["storage"] = (await client.get("/storage/stats/")).json()
+        sampler.cancel()
+        await asyncio.gather(sampler, return_exceptions=True)
+
+    disk_peak[0] = max(disk_peak[0], directory_size(data_paths))
+    report["disk"] = {"peak_bytes": disk_peak[0], "after_bytes": directory_size(data_paths)}
+    report["peak_rss_bytes"] = peak_rss()
+    return report
+
+def format_seconds(value: float | None) -> str:
+    return "-" if value is None else f"{value:.3f}s"
+
+def format_bytes(value: int | None) -> str:
+    return "-" if value is None else f"{value / (1024 * 1024):.1f} MiB"
+
+def print_report(report: dict) -> None:
+    for scenario in ("server", "bot"):
+        if scenario not in report:
+            continue
+        result = report[scenario]
+        print(f"[{scenario}] {result['completed']}/{result['requests']} completed, {result['errors']} errors, "
+              f"{result['rejected']} rejected in {result['duration_seconds']:.2f}s "
+              f"({result['throughput_per_second']:.2f} try-ons/s)")
+        print(f"[{scenario}] latency p50 {format_seconds(result['latency_p50'])}, "
+              f"p95 {format_seconds(result['latency_p95'])}, p99 {format_seconds(result['latency_p99'])}")
+        if "telegram_calls_per_flow" in result:
+            print(f"[{scenario}] {result['telegram_calls_per_flow']:.1f} Telegram calls per flow")
+    for backend in report["backends"]:
+        print(f"[backend] {backend['name']}: {backend['requests']} requests, {backend['errors']} errors, "
+              f"latency {format_seconds(backend['latency_seconds'])}")
+    cache = report["cache"]
+    print(f"[cache] {cache.get('hits')} hits, {cache.get('misses')} misses")
+    storage = report["storage"]
+    print(f"[storage] {storage['files']} files, {format_bytes(storage['size_bytes'])} "
+          f"({storage['referenced_files']} referenced), {storage['deduplicated_files']} duplicates stored once")
+    print(f"[memory] peak RSS {format_bytes(report['peak_rss_bytes']['self'])}, "
+          f"preprocessing workers {format_bytes(report['peak_rss_bytes']['children'])}")
+    disk = report["disk"]
+    print(f"[disk] peak {format_bytes(disk['peak_bytes'])}, after the run {format_bytes(disk['after_bytes'])}")
+
+def check_thresholds(report: dict, args: argparse.Namespace) -> list[str]:
+    """Return a description of every regression threshold the run exceeded."""
+    failures = []
+    for scenario in ("server", "bot"):
+        result = report.get(scenario)
+        if result is None:
+            continue
+        if args.max_p95 is not None and (result["latency_p95"] is None or result["latency_p95"] > args.max_p95):
+            failures.append(f"{scenario} p95 latency {format_seconds(result['latency_p95'])} exceeds {args.max_p95}s")
+        if args.max_error_rate is not None and result["error_rate"] > args.max_error_rate:
+            failures.append(f"{scenario} error rate {result['error_rate']:.3f} exceeds {args.max_error_rate}")
+    return failures
+
+def main() -> None:
+    args = parse_args()
+    with tempfile.TemporaryDirectory(prefix="tryon_bench_") as workdir:
+        os.makedirs(os.path.join(workdir, "garments"))
+        httpd, garment_base_url = start_garment_server(os.path.join(workdir, "garments"), args.products)
+        try:
+            products = write_catalog(os.path.join(workdir, "catalog.json"), garment_base_url, args.products)
+            configure_environment(args, workdir)
+            sys.path.insert(0, BASE_DIR)
+            import server  # noqa: F401  (configures logging on import)
+            if not args.verbose:
+                logging.getLogger().setLevel(logging.WARNING)
+            report = asyncio.run(run(args, workdir, garment_base_url, products))
+        finally:
+            httpd.shutdown()
+
+    print_report(report)
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    failures = check_thresholds(report, args)
+    for failure in failures:
+        print(f"REGRESSION: {failure}")
+    if failures:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from bisect import bisect_left
+from email.utils import formatdate
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+def tokenize(text: str) -> list[str]:
+    """Split text into lowercase word tokens."""
+    return TOKEN_PATTERN.findall(text.lower())
+
+class CatalogIndex:
+    """In-memory index of catalog positions by product id, model, color and the word tokens of name, model and color."""
+
+    def __init__(self, products: tuple) -> None:
+        self.size: int = len(products)
+        self.by_id: dict[int, int] = {}
+        self.by_model: dict[str, set[int]] = {}
+        self.by_color: dict[str, set[int]] = {}
+        self.by_token: dict[str, set[int]] = {}
+        for position, product in enumerate(products):
+            self.by_id[product['id']] = position
+            self.by_model.setdefault(str(product.get('model', '')).lower(), set()).add(position)
+            self.by_color.setdefault(str(product.get('color', '')).lower(), set()).add(position)
+            text = f"{product.get('name', '')} {product.get('model', '')} {product.get('color', '')}"
+            for token in tokenize(text):
+                self.by_token.setdefault(token, set()).add(position)
+        # Sorted once so that the last word of a query can be matched as a prefix while the user is still typing it.
+        self.tokens: list[str] = sorted(self.by_token)
+
+    def search(self, query: str | None = None, model: str | None = None, color: str | None = None) -> list[int]:
+        """Return the catalog positions, in catalog order, of products matching every word of the query and the model and color filters."""
+        matches: list[set[int]] = []
+        if model:
+            matches.append(self.by_model.get(model.lower(), set()))
+        if color:
+            matches.append(self.by_color.get(color.lower(), set()))
+        words = tokenize(query or '')
+        for word in words[:-1]:
+            matches.append(self.by_token.get(word, set()))
+        if words:
+            matches.append(self._prefix_matches(words[-1]))
+        if not matches:
+            return list(range(self.size))
+        matches.sort(key=len)
+        return sorted(set.intersection(*matches))
+
+    def _prefix_matches(self, prefix: str) -> set[int]:
+        positions = set()
+        for index in range(bisect_left(self.tokens, prefix), len(self.tokens)):
+            if not self.tokens[index].startswith(prefix):
+                break
+            positions |= self.by_token[self.tokens[index]]
+        return positions
+
+class CatalogSnapshot:
+    """One parsed version of the catalog file together with its search index and HTTP validators."""
+
+    def __init__(self, products: tuple, body: bytes, etag: str, last_modified: str) -> None:
+        self.products: tuple = products
+        self.index: CatalogIndex = CatalogIndex(products)
+        self.body: bytes = body
+        self.etag: str = etag
+        self.last_modified: str = last_modified
+
+class CatalogCache:
+    """Parsed product catalog that is reloaded only when the JSON file changes on disk."""
+
+    def __init__(self, path: str) -> None:
+        self.path: str = path
+        self._lock = threading.Lock()
+        self._current: tuple[tuple[int, int], CatalogSnapshot] | None = None
+
+    def get(self) -> CatalogSnapshot:
+        """Return the current catalog, re-parsing the file only if its mtime or size changed."""
+        stat = os.stat(self.path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        current = self._current
+        if current is not None and current[0] == signature:
+            return current[1]
+
+        with self._lock:
+            current = self._current
+            if current is not None and current[0] == signature:
+                return current[1]
+            with open(self.path, 'r', encoding='utf-8') as f:
+                products = json.load(f)
+            body = json.dumps(products, ensure_ascii=False).encode('utf-8')
+            snapshot = CatalogSnapshot(
+                products=tuple(products),
+                body=body,
+                etag=f'"{hashlib.sha1(body).hexdigest()}"',
+                last_modified=formatdate(stat.st_mtime, usegmt=True),
+            )
+            self._current = (signature, snapshot)
+            return snapshot
+
+    def find(self, product_id: int) -> dict | None:
+        """Return the catalog entry for a product id, or None if it is not in the catalog."""
+        snapshot = self.get()
+        position = snapshot.index.by_id.get(product_id)
+        return snapshot.products[position] if position is not None else None
\ No newline at end of file
@@ -8,7 +8,47 @@ class Config:
 
     def __init__(self) -> None:
         self.model_name: str = os.getenv("MODEL_NAME")
+        self.model_names: list[str] = [name.strip() for name in os.getenv("MODEL_NAMES", self.model_name or "").split(",") if name.strip()]
         self.ht_token: str = os.getenv("HT_TOKEN")
         self.js_data_url: str = os.getenv("JSON_DATA_URL")
-        if not self.model_name or not self.ht_token or not self.js_data_url:
-            raise EnvironmentError("Please set MODEL_NAME, HT_TOKEN and JS_DATA_URL in the .env file.")
\ No newline at end of file
+        self.data_dir: str | None = os.getenv("DATA_DIR")
+        self.catalog_max_page_size: int = int(os.getenv("CATALOG_MAX_PAGE_SIZE", 100))
+        self.max_upload_size: int = int(os.getenv("MAX_UPLOAD_SIZE", 10 * 1024 * 1024))
+        # A request carries up to two images, base64-encoded by the legacy /upload/ endpoint.
+        self.max_request_size: int = int(os.getenv("MAX_REQUEST_SIZE", 3 * self.max_upload_size))
+        self.inference_workers: int = int(os.getenv("INFERENCE_WORKERS", 2))
+        self.max_queue_depth: int = int(os.getenv("MAX_QUEUE_DEPTH", 20))
+        self.queue_retry_after: int = int(os.getenv("QUEUE_RETRY_AFTER", 30))
+        self.max_user_jobs: int = int(os.getenv("MAX_USER_JOBS", 2))
+        self.batch_max_items: int = int(os.getenv("BATCH_MAX_ITEMS", 10))
+        self.batch_concurrency: int = int(os.getenv("BATCH_CONCURRENCY", 2))
+        self.task_store_backend: str = os.getenv("TASK_STORE", "sqlite")
+        self.task_store_path: str = os.getenv("TASK_STORE_PATH", "tasks.db")
+        self.task_store_max_items: int = int(os.getenv("TASK_STORE_MAX_ITEMS", 10000))
+        self.task_ttl: float = float(os.getenv("TASK_TTL", 24 * 60 * 60))
+        self.job_journal_path: str = os.getenv("JOB_JOURNAL_PATH", "jobs.db")
+        self.job_lease: float = float(os.getenv("JOB_LEASE", 30))
+        self.job_heartbeat_interval: float = float(os.getenv("JOB_HEARTBEAT_INTERVAL", 10))
+        self.long_poll_max_timeout: float = float(os.getenv("LONG_POLL_MAX_TIMEOUT", 30))
+        self.long_poll_recheck_interval: float = float(os.getenv("LONG_POLL_RECHECK_INTERVAL", 5))
+        self.result_cache_max_bytes: int = int(os.getenv("RESULT_CACHE_MAX_BYTES", 1024 * 1024 * 1024))
+        self.thumbnail_max_side: int = int(os.getenv("THUMBNAIL_MAX_SIDE", 320))
+        self.thumbnail_jpeg_quality: int = int(os.getenv("THUMBNAIL_JPEG_QUALITY", 80))
+        self.thumbnail_cache_max_bytes: int = int(os.getenv("THUMBNAIL_CACHE_MAX_BYTES", 100 * 1024 * 1024))
+        self.storage_index_path: str = os.getenv("STORAGE_INDEX_PATH", "store.db")
+        self.storage_max_bytes: int = int(os.getenv("STORAGE_MAX_BYTES", 5 * 1024 * 1024 * 1024))
+        self.storage_max_age: float = float(os.getenv("STORAGE_MAX_AGE", self.task_ttl))
+        self.storage_gc_interval: float = float(os.getenv("STORAGE_GC_INTERVAL", 300))
+        self.quality_tiers: dict[str, dict] = {
+            "preview": {"denoise_steps": int(os.getenv("PREVIEW_DENOISE_STEPS", 10))},
+            "full": {"denoise_steps": int(os.getenv("FULL_DENOISE_STEPS", 30))},
+        }
+        self.preprocess_max_side: int = int(os.getenv("PREPROCESS_MAX_SIDE", 1024))
+        self.preprocess_jpeg_quality: int = int(os.getenv("PREPROCESS_JPEG_QUALITY", 90))
+        self.preprocess_workers: int = int(os.getenv("PREPROCESS_WORKERS", 2))
+        self.backend_max_failures: int = int(os.getenv("BACKEND_MAX_FAILURES", 3))
+        self.backend_base_backoff: float = float(os.getenv("BACKEND_BASE_BACKOFF", 10))
+        self.backend_max_backoff: float = float(os.getenv("BACKEND_MAX_BACKOFF", 300))
+        self.inference_max_attempts: int = int(os.getenv("INFERENCE_MAX_ATTEMPTS", 2))
+        if not self.model_names or not self.ht_token or not self.js_data_url:
+            raise EnvironmentError("Please set MODEL_NAME (or MODEL_NAMES), HT_TOKEN and JS_DATA_URL in the .env file.")
\ No newline at end of file
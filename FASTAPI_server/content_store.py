@@ -0,0 +1,280 @@
+import asyncio
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def remove_quietly(paths: list[str]) -> None:
+    """Delete files, logging the ones that cannot be removed."""
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.error("Failed to remove stored file %s: %s", path, e)
+
+def link_or_copy(source_path: str, destination_path: str) -> None:
+    """Hard-link a file so identical bytes share one inode, copying when the filesystem cannot link."""
+    try:
+        os.link(source_path, destination_path)
+    except OSError:
+        shutil.copyfile(source_path, destination_path)
+
+# Scratch files older than this are left by a process that stopped while writing them.
+TEMPORARY_FILE_MAX_AGE = 3600.0
+
+class ContentStore:
+    """Content-addressed file store that keeps identical files once, counts references to them and evicts unreferenced files by age and size; its index is a SQLite file so that server processes sharing the directory see each other's references, each held under a leased owner id."""
+
+    def __init__(self, directory: str, index_path: str, max_bytes: int, max_age: float, lease: float) -> None:
+        self.directory: str = directory
+        self.max_bytes: int = max_bytes
+        self.max_age: float = max_age
+        self.lease: float = lease
+        self.owner: str = uuid.uuid4().hex
+        self.deduplicated_files: int = 0
+        self.deduplicated_bytes: int = 0
+        self.evicted_files: int = 0
+        self.evicted_bytes: int = 0
+        self._lock = threading.Lock()
+        # Total bytes in the store as of this process's last write or collection, so that reading it never waits on the index.
+        self._size: int = 0
+        os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(index_path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS files_last_used ON files (last_used)")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS holds ("
+            "path TEXT NOT NULL, owner TEXT NOT NULL, refs INTEGER NOT NULL, PRIMARY KEY (path, owner))"
+        )
+        self._connection.execute("CREATE TABLE IF NOT EXISTS owners (owner TEXT PRIMARY KEY, heartbeat REAL NOT NULL)")
+        self.heartbeat()
+        self._load()
+
+    @contextmanager
+    def _transaction(self):
+        """Hold the in-process lock and SQLite's write lock, which serialises changes to the directory across processes."""
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._connection
+            except BaseException:
+                if self._connection.in_transaction:
+                    self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+
+    def _load(self) -> None:
+        """Index files missing from the index as unreferenced, forget entries whose file is gone and drop abandoned writes."""
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    # Evicted or renamed into place by another process meanwhile.
+                    continue
+                if name.endswith(".tmp"):
+                    if stat.st_mtime < time.time() - TEMPORARY_FILE_MAX_AGE:
+                        remove_quietly([path])
+                    continue
+                files.append((path, stat.st_size, stat.st_mtime))
+        with self._transaction() as connection:
+            connection.executemany("INSERT OR IGNORE INTO files (path, size, last_used) VALUES (?, ?, ?)", files)
+            for (path,) in connection.execute("SELECT path FROM files").fetchall():
+                if not os.path.exists(path):
+                    self._forget(path)
+            self._size = self._total_size()
+
+    def heartbeat(self) -> None:
+        """Renew the lease on the references this process holds."""
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO owners (owner, heartbeat) VALUES (?, ?)",
+                                     (self.owner, time.time()))
+
+    def add(self, source_path: str, move: bool = False, hold: bool = True) -> str:
+        """Store a file under the hash of its content and return the stored path, taking a reference to it if hold is set."""
+        digest = hash_file(source_path)
+        path = os.path.join(self.directory, digest[:2], f"{digest}{os.path.splitext(source_path)[1].lower()}")
+        # Write the bytes aside first so that the index is locked only for the rename.
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        if move:
+            shutil.move(source_path, temporary_path)
+        else:
+            link_or_copy(source_path, temporary_path)
+        now = time.time()
+        # Files to delete once the index is unlocked.
+        discarded = []
+        with self._transaction() as connection:
+            row = connection.execute("SELECT size FROM files WHERE path = ?", (path,)).fetchone()
+            if row is not None and os.path.exists(path):
+                self.deduplicated_files += 1
+                self.deduplicated_bytes += row[0]
+                discarded.append(temporary_path)
+                connection.execute("UPDATE files SET last_used = ? WHERE path = ?", (now, path))
+            else:
+                os.replace(temporary_path, path)
+                connection.execute("INSERT OR REPLACE INTO files (path, size, last_used) VALUES (?, ?, ?)",
+                                   (path, os.path.getsize(path), now))
+            if hold:
+                self._hold(path)
+            self._evict_over_capacity(discarded)
+        remove_quietly(discarded)
+        return path
+
+    def owns(self, path: str) -> bool:
+        """Whether a path points at a file managed by this store."""
+        with self._lock:
+            return self._connection.execute("SELECT 1 FROM files WHERE path = ?", (path,)).fetchone() is not None
+
+    def retain(self, path: str) -> bool:
+        """Take a reference to a file that is already stored, e.g. for a job resumed after a restart; return whether it is."""
+        with self._transaction() as connection:
+            if connection.execute("SELECT 1 FROM files WHERE path = ?", (path,)).fetchone() is None \
+                    or not os.path.exists(path):
+                return False
+            connection.execute("UPDATE files SET last_used = ? WHERE path = ?", (time.time(), path))
+            self._hold(path)
+            return True
+
+    def touch(self, path: str) -> None:
+        """Mark a stored file as recently used so that it is evicted last; a busy index only costs the file its place."""
+        try:
+            with self._lock:
+                self._connection.execute("UPDATE files SET last_used = ? WHERE path = ?", (time.time(), path))
+        except sqlite3.OperationalError as e:
+            logging.warning("Failed to mark stored file %s as used: %s", path, e)
+
+    def release(self, path: str) -> None:
+        """Drop one of this process's references to a stored file; unreferenced files stay on disk until the collector evicts them."""
+        with self._transaction() as connection:
+            connection.execute("UPDATE holds SET refs = refs - 1 WHERE path = ? AND owner = ?", (path, self.owner))
+            connection.execute("DELETE FROM holds WHERE path = ? AND owner = ? AND refs <= 0", (path, self.owner))
+            connection.execute("UPDATE files SET last_used = ? WHERE path = ?", (time.time(), path))
+
+    def collect(self) -> int:
+        """Evict unreferenced files unused for longer than max_age, then the least recently used ones until the store fits in max_bytes; return the bytes freed."""
+        discarded = []
+        with self._transaction() as connection:
+            # References of processes that stopped renewing their lease no longer protect anything.
+            expired = time.time() - self.lease
+            connection.execute("DELETE FROM holds WHERE owner IN (SELECT owner FROM owners WHERE heartbeat < ?)",
+                               (expired,))
+            connection.execute("DELETE FROM owners WHERE heartbeat < ?", (expired,))
+            freed = 0
+            for path, _ in self._unreferenced(time.time() - self.max_age):
+                freed += self._evict(path, discarded)
+            freed += self._evict_over_capacity(discarded)
+        remove_quietly(discarded)
+        return freed
+
+    async def run_collector(self, interval: float) -> None:
+        """Collect garbage every interval seconds."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                freed = await asyncio.to_thread(self.collect)
+                if freed:
+                    logging.info("Content store evicted %d bytes", freed)
+            except Exception as e:
+                logging.error("Content store garbage collection failed: %s", e)
+
+    def stats(self) -> dict:
+        """Report the store's disk usage and references across processes, and this process's deduplication savings and evictions."""
+        with self._lock:
+            files, size = self._connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM files").fetchone()
+            referenced_files, referenced_bytes = self._connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM files WHERE path IN "
+                "(SELECT path FROM holds JOIN owners USING (owner) WHERE heartbeat >= ?)",
+                (time.time() - self.lease,)
+            ).fetchone()
+        return {
+            "files": files,
+            "size_bytes": size,
+            "max_bytes": self.max_bytes,
+            "referenced_files": referenced_files,
+            "referenced_bytes": referenced_bytes,
+            "deduplicated_files": self.deduplicated_files,
+            "deduplicated_bytes": self.deduplicated_bytes,
+            "evicted_files": self.evicted_files,
+            "evicted_bytes": self.evicted_bytes,
+        }
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def _total_size(self) -> int:
+        return self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM files").fetchone()[0]
+
+    def _hold(self, path: str) -> None:
+        self._connection.execute(
+            "INSERT INTO holds (path, owner, refs) VALUES (?, ?, 1) "
+            "ON CONFLICT (path, owner) DO UPDATE SET refs = refs + 1",
+            (path, self.owner)
+        )
+
+    def _unreferenced(self, used_before: float) -> list[tuple[str, int]]:
+        """Files no live process holds, least recently used first."""
+        return self._connection.execute(
+            "SELECT path, size FROM files WHERE last_used < ? AND path NOT IN "
+            "(SELECT path FROM holds JOIN owners USING (owner) WHERE heartbeat >= ?) ORDER BY last_used",
+            (used_before, time.time() - self.lease)
+        ).fetchall()
+
+    def _evict_over_capacity(self, discarded: list[str]) -> int:
+        freed = 0
+        size = self._size = self._total_size()
+        if size <= self.max_bytes:
+            return freed
+        for path, file_size in self._unreferenced(float("inf")):
+            if size <= self.max_bytes:
+                break
+            freed += self._evict(path, discarded)
+            size -= file_size
+        self._size = size
+        if size > self.max_bytes:
+            logging.warning("Content store holds %d bytes of referenced files, above its %d byte cap",
+                            size, self.max_bytes)
+        return freed
+
+    def _evict(self, path: str, discarded: list[str]) -> int:
+        """Forget a file and move it aside for deletion after the transaction, so that a process storing the same content meanwhile writes a fresh copy."""
+        size = self._forget(path)
+        doomed_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            os.rename(path, doomed_path)
+            discarded.append(doomed_path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.error("Failed to remove stored file %s: %s", path, e)
+        self.evicted_files += 1
+        self.evicted_bytes += size
+        return size
+
+    def _forget(self, path: str) -> int:
+        row = self._connection.execute("SELECT size FROM files WHERE path = ?", (path,)).fetchone()
+        self._connection.execute("DELETE FROM files WHERE path = ?", (path,))
+        self._connection.execute("DELETE FROM holds WHERE path = ?", (path,))
+        return row[0] if row else 0
@@ -0,0 +1,44 @@
+import os
+import random
+import tempfile
+import time
+from PIL import Image
+
+def _file_path(value) -> str:
+    """Accept either a plain path or the FileData dict built by gradio_client.file()."""
+    return value['path'] if isinstance(value, dict) else value
+
+class FakeTryOnError(Exception):
+    """Simulated failure of the fake /tryon backend."""
+
+class FakeTryOnClient:
+    """Local stand-in for the IDM-VTON /tryon Gradio API with configurable latency, jitter and failure rate."""
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, failure_rate: float = 0.0, seed: int | None = None) -> None:
+        self.latency: float = latency
+        self.jitter: float = jitter
+        self.failure_rate: float = failure_rate
+        self._random = random.Random(seed)
+        self.calls: int = 0
+
+    def predict(self, dict: dict, garm_img, garment_des: str, is_checked: bool, is_checked_crop: bool,
+                denoise_steps: int, seed: int, api_name: str) -> tuple[str, str]:
+        """Mimic /tryon: wait, maybe fail, then return (result_path, mask_path) for a composite image."""
+        if api_name != "/tryon":
+            raise ValueError(f"Unknown api_name {api_name}")
+        self.calls += 1
+        time.sleep(max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter)))
+        if self._random.random() < self.failure_rate:
+            raise FakeTryOnError("Simulated /tryon failure.")
+
+        output_dir = tempfile.mkdtemp(prefix="fake_tryon_")
+        result_path = os.path.join(output_dir, "image.png")
+        mask_path = os.path.join(output_dir, "mask.png")
+        with Image.open(_file_path(dict['background'])) as person, Image.open(_file_path(garm_img)) as garment:
+            result = person.convert('RGB')
+            garment = garment.convert('RGB')
+            garment.thumbnail((result.width // 2, result.height // 2))
+            result.paste(garment, ((result.width - garment.width) // 2, (result.height - garment.height) // 3))
+            result.save(result_path)
+            Image.new('L', result.size, 0).save(mask_path)
+        return result_path, mask_path
\ No newline at end of file
@@ -0,0 +1,50 @@
+import os
+from fastapi import UploadFile
+
+CHUNK_SIZE = 64 * 1024
+
+IMAGE_SIGNATURES = {
+    b'\xff\xd8\xff': '.jpg',
+    b'\x89PNG\r\n\x1a\n': '.png',
+}
+
+class UploadValidationError(Exception):
+    """Raised when an uploaded file is rejected during streaming."""
+
+    def __init__(self, message: str, status_code: int) -> None:
+        super().__init__(message)
+        self.message: str = message
+        self.status_code: int = status_code
+
+def detect_image_extension(header: bytes) -> str | None:
+    """Return the file extension matching the image signature, or None if unsupported."""
+    for signature, extension in IMAGE_SIGNATURES.items():
+        if header.startswith(signature):
+            return extension
+    return None
+
+async def save_upload_file(upload_file: UploadFile, destination_dir: str, file_stem: str, max_size: int) -> str:
+    """Stream an uploaded image to disk in chunks, validating its type and size as the bytes arrive."""
+    chunk = await upload_file.read(CHUNK_SIZE)
+    extension = detect_image_extension(chunk)
+    if extension is None:
+        raise UploadValidationError(f"Unsupported file type for {upload_file.filename}. Use JPG or PNG.", 415)
+
+    file_path = os.path.join(destination_dir, f"{file_stem}{extension}")
+    written = 0
+    try:
+        with open(file_path, "wb") as f:
+            while chunk:
+                written += len(chunk)
+                if written > max_size:
+                    raise UploadValidationError(f"File {upload_file.filename} exceeds {max_size} bytes.", 413)
+                f.write(chunk)
+                chunk = await upload_file.read(CHUNK_SIZE)
+    except BaseException:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        raise
+    finally:
+        await upload_file.close()
+
+    return file_path
\ No newline at end of file
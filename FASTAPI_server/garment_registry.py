@@ -0,0 +1,126 @@
+import asyncio
+import io
+import json
+import logging
+import os
+import time
+import uuid
+import httpx
+from PIL import Image
+from catalog import CatalogCache
+from content_store import TEMPORARY_FILE_MAX_AGE
+
+GARMENT_JPEG_QUALITY = 95
+
+def normalise_garment_image(image_bytes: bytes, destination_path: str, max_side: int) -> None:
+    """Flatten a garment image onto a white background, downscale it to max_side and save it as an RGB JPEG."""
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+    background.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+    # Processes sharing the directory may normalise the same garment at once; each writes its own file.
+    temporary_path = f"{destination_path}.{uuid.uuid4().hex}.tmp"
+    background.save(temporary_path, format='JPEG', quality=GARMENT_JPEG_QUALITY)
+    os.replace(temporary_path, destination_path)
+
+class GarmentRegistry:
+    """Keeps a normalised local copy of every catalog garment image, indexed by product id; processes sharing the directory treat the index file as a hint they merge into."""
+
+    def __init__(self, directory: str, catalog: CatalogCache, max_side: int) -> None:
+        self.directory: str = directory
+        self.catalog: CatalogCache = catalog
+        self.max_side: int = max_side
+        self.index_path: str = os.path.join(directory, 'index.json')
+        self._index: dict[str, dict] = {}
+        self._locks: dict[str, asyncio.Lock] = {}
+        self._index_lock = asyncio.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._remove_abandoned_writes()
+        self._index = self._read_index()
+
+    def _remove_abandoned_writes(self) -> None:
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.name.endswith('.tmp') and entry.stat().st_mtime < time.time() - TEMPORARY_FILE_MAX_AGE:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+    def _read_index(self) -> dict[str, dict]:
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logging.warning("Ignoring unreadable garment index %s: %s", self.index_path, e)
+            return {}
+
+    def _write_index(self, body: str) -> None:
+        temporary_path = f"{self.index_path}.{uuid.uuid4().hex}.tmp"
+        with open(temporary_path, 'w', encoding='utf-8') as f:
+            f.write(body)
+        os.replace(temporary_path, self.index_path)
+
+    async def _save_index(self) -> None:
+        # Keep the entries other processes wrote since; one lost to a concurrent write only costs a second fetch.
+        async with self._index_lock:
+            self._index = {**await asyncio.to_thread(self._read_index), **self._index}
+            await asyncio.to_thread(self._write_index, json.dumps(self._index, ensure_ascii=False))
+
+    def description(self, product_id: int) -> str | None:
+        """Return the catalog description of a product, or None if it is not in the catalog."""
+        product = self.catalog.find(product_id)
+        return product['description'] if product else None
+
+    async def get_path(self, product_id: int, client: httpx.AsyncClient | None = None) -> str | None:
+        """Return the local garment image for a product, fetching it first if it is missing or outdated."""
+        key = str(product_id)
+        product = self.catalog.find(product_id)
+        if product is None:
+            return None
+
+        entry = self._index.get(key)
+        if entry and entry['image_url'] == product['image_url'] and os.path.exists(entry['path']):
+            return entry['path']
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            entry = self._index.get(key)
+            if entry and entry['image_url'] == product['image_url'] and os.path.exists(entry['path']):
+                return entry['path']
+            # Another process sharing the directory may have fetched it already.
+            entry = (await asyncio.to_thread(self._read_index)).get(key)
+            if entry and entry['image_url'] == product['image_url'] and os.path.exists(entry['path']):
+                self._index[key] = entry
+                return entry['path']
+
+            if client is None:
+                async with httpx.AsyncClient() as own_client:
+                    return await self._fetch(key, product, own_client)
+            return await self._fetch(key, product, client)
+
+    async def _fetch(self, key: str, product: dict, client: httpx.AsyncClient) -> str:
+        response = await client.get(product['image_url'])
+        response.raise_for_status()
+        path = os.path.join(self.directory, f"{key}.jpg")
+        await asyncio.to_thread(normalise_garment_image, response.content, path, self.max_side)
+        self._index[key] = {'image_url': product['image_url'], 'path': path}
+        await self._save_index()
+        logging.info("Garment image for product %s stored at %s", key, path)
+        return path
+
+    async def sync(self) -> None:
+        """Pre-fetch the garment image of every catalog product."""
+        try:
+            product_ids = [product['id'] for product in self.catalog.get().products]
+        except Exception as e:
+            logging.error("Failed to load catalog for garment registry: %s", e)
+            return
+        async with httpx.AsyncClient() as client:
+            for product_id in product_ids:
+                try:
+                    await self.get_path(product_id, client)
+                except Exception as e:
+                    logging.error("Failed to pre-fetch garment image for product %s: %s", product_id, e)
\ No newline at end of file
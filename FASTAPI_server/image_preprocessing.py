@@ -0,0 +1,33 @@
+import os
+from PIL import Image, ImageOps
+
+EXIF_ORIENTATION_TAG = 0x0112
+
+def preprocess_image(source_path: str, max_side: int, jpeg_quality: int) -> str:
+    """Fix EXIF orientation, downscale to max_side and re-encode as JPEG, leaving upright JPEGs that already fit untouched."""
+    with Image.open(source_path) as image:
+        orientation = image.getexif().get(EXIF_ORIENTATION_TAG, 1)
+        if image.format == 'JPEG' and orientation == 1 and max(image.size) <= max_side:
+            return source_path
+
+        image = ImageOps.exif_transpose(image)
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+
+        destination_path = f"{os.path.splitext(source_path)[0]}.jpg"
+        temporary_path = f"{destination_path}.tmp"
+        image.save(temporary_path, format='JPEG', quality=jpeg_quality, optimize=True)
+
+    os.replace(temporary_path, destination_path)
+    if destination_path != source_path:
+        os.remove(source_path)
+    return destination_path
+
+def make_thumbnail(source_path: str, destination_path: str, max_side: int, jpeg_quality: int) -> None:
+    """Save a JPEG copy of an image downscaled to fit max_side, letting JPEG sources decode at reduced scale."""
+    with Image.open(source_path) as image:
+        image.draft('RGB', (max_side, max_side))
+        image = image.convert('RGB')
+        image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+        image.save(destination_path, format='JPEG', quality=jpeg_quality, optimize=True)
@@ -0,0 +1,133 @@
+import asyncio
+import logging
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+from fake_tryon import FakeTryOnClient
+
+LATENCY_SMOOTHING = 0.3
+
+class NoHealthyBackendError(Exception):
+    """Raised when every inference backend is ejected."""
+
+def create_client(spec: str, hf_token: str):
+    """Build an inference client from a backend spec: a Gradio Space name, or fake?latency=..&jitter=..&failure_rate=.."""
+    if spec == "fake" or spec.startswith("fake?"):
+        options = {key: float(values[0]) for key, values in parse_qs(urlsplit(spec).query).items()}
+        return FakeTryOnClient(**options)
+    from gradio_client import Client
+    return Client(spec, hf_token=hf_token)
+
+class Backend:
+    """One inference endpoint with its lazily created client and health statistics."""
+
+    def __init__(self, name: str, client_factory) -> None:
+        self.name: str = name
+        self._client_factory = client_factory
+        self._client = None
+        self._client_lock = threading.Lock()
+        self.in_flight: int = 0
+        self.requests: int = 0
+        self.errors: int = 0
+        self.consecutive_failures: int = 0
+        self.ejections: int = 0
+        self.ejected_until: float = 0.0
+        self.latency: float | None = None
+
+    @property
+    def client(self):
+        with self._client_lock:
+            if self._client is None:
+                self._client = self._client_factory()
+            return self._client
+
+    def is_healthy(self, now: float) -> bool:
+        return now >= self.ejected_until
+
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            "healthy": self.is_healthy(time.monotonic()),
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "errors": self.errors,
+            "error_rate": self.errors / self.requests if self.requests else 0.0,
+            "latency_seconds": self.latency,
+            "ejections": self.ejections,
+        }
+
+class InferenceRouter:
+    """Sends each inference call to the least-loaded healthy backend and ejects failing ones with backoff."""
+
+    def __init__(self, backends: list[Backend], max_failures: int, base_backoff: float, max_backoff: float,
+                 max_attempts: int) -> None:
+        if not backends:
+            raise ValueError("At least one inference backend is required.")
+        self.backends: list[Backend] = backends
+        self.max_failures: int = max_failures
+        self.base_backoff: float = base_backoff
+        self.max_backoff: float = max_backoff
+        self.max_attempts: int = max_attempts
+
+    def _pick(self, exclude: set[str]) -> Backend:
+        now = time.monotonic()
+        candidates = [backend for backend in self.backends if backend.is_healthy(now) and backend.name not in exclude]
+        if not candidates:
+            raise NoHealthyBackendError("No healthy inference backend is available.")
+        # Unmeasured backends sort first so that each one gets probed.
+        return min(candidates, key=lambda backend: (backend.in_flight, backend.latency or 0.0))
+
+    async def predict(self, **kwargs):
+        """Run a prediction, retrying on another backend when one fails."""
+        tried: set[str] = set()
+        last_error: Exception | None = None
+        for _ in range(min(self.max_attempts, len(self.backends))):
+            try:
+                backend = self._pick(tried)
+            except NoHealthyBackendError:
+                if last_error is not None:
+                    raise last_error
+                raise
+            tried.add(backend.name)
+            try:
+                return await self._call(backend, kwargs)
+            except Exception as e:
+                logging.error("Inference backend %s failed: %s", backend.name, e)
+                last_error = e
+        raise last_error
+
+    async def _call(self, backend: Backend, kwargs: dict):
+        backend.in_flight += 1
+        backend.requests += 1
+        started = time.monotonic()
+        try:
+            result = await asyncio.to_thread(lambda: backend.client.predict(**kwargs))
+        except Exception:
+            backend.errors += 1
+            backend.consecutive_failures += 1
+            # A backend that was ejected before and has not recovered yet goes straight back out;
+            # calls that were already in flight when it was ejected do not extend the backoff.
+            if backend.is_healthy(time.monotonic()) and (
+                    backend.consecutive_failures >= self.max_failures or backend.ejections):
+                self._eject(backend)
+            raise
+        finally:
+            backend.in_flight -= 1
+
+        elapsed = time.monotonic() - started
+        backend.latency = elapsed if backend.latency is None else (
+            LATENCY_SMOOTHING * elapsed + (1 - LATENCY_SMOOTHING) * backend.latency)
+        backend.consecutive_failures = 0
+        backend.ejections = 0
+        return result
+
+    def _eject(self, backend: Backend) -> None:
+        backoff = min(self.base_backoff * 2 ** backend.ejections, self.max_backoff)
+        backend.ejections += 1
+        backend.consecutive_failures = 0
+        backend.ejected_until = time.monotonic() + backoff
+        logging.warning("Ejecting inference backend %s for %.0f seconds", backend.name, backoff)
+
+    def stats(self) -> list[dict]:
+        """Return per-backend load, latency and error statistics."""
+        return [backend.stats() for backend in self.backends]
\ No newline at end of file
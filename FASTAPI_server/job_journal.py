@@ -0,0 +1,90 @@
+import json
+import sqlite3
+import threading
+import time
+import uuid
+
+class JournaledJob:
+    """A job read back from the journal, with everything needed to queue it again."""
+
+    def __init__(self, job_id: str, user_id: str, handler: str, args: list, record: dict,
+                 cache_key: str | None, task_ids: list[str]) -> None:
+        self.job_id: str = job_id
+        self.user_id: str = user_id
+        self.handler: str = handler
+        self.args: list = args
+        self.record: dict = record
+        self.cache_key: str | None = cache_key
+        self.task_ids: list[str] = task_ids
+
+class JobJournal:
+    """Durable log of accepted jobs on a local SQLite file; each process leases its jobs with a heartbeat so that another one can resume them once it stops."""
+
+    def __init__(self, path: str, lease: float) -> None:
+        self.lease: float = lease
+        self.owner: str = uuid.uuid4().hex
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "job_id TEXT PRIMARY KEY, user_id TEXT NOT NULL, handler TEXT NOT NULL, args TEXT NOT NULL, "
+            "record TEXT NOT NULL, cache_key TEXT, task_ids TEXT NOT NULL, owner TEXT NOT NULL, "
+            "heartbeat REAL NOT NULL, created_at REAL NOT NULL)"
+        )
+
+    def add(self, job_id: str, user_id: str, handler: str, args: tuple, record: dict,
+            cache_key: str | None = None) -> None:
+        """Record a job accepted by this process together with the task record to show while it waits."""
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO jobs (job_id, user_id, handler, args, record, cache_key, task_ids, owner, "
+                "heartbeat, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, user_id, handler, json.dumps(args), json.dumps(record), cache_key, json.dumps([job_id]),
+                 self.owner, now, now)
+            )
+
+    def attach(self, job_id: str, task_id: str) -> None:
+        """Record another task waiting for the result of a journaled job."""
+        with self._lock:
+            row = self._connection.execute("SELECT task_ids FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is not None:
+                self._connection.execute("UPDATE jobs SET task_ids = ? WHERE job_id = ?",
+                                         (json.dumps(json.loads(row[0]) + [task_id]), job_id))
+
+    def remove(self, job_id: str) -> None:
+        """Forget a job that has finished."""
+        with self._lock:
+            self._connection.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+
+    def heartbeat(self) -> None:
+        """Renew the lease on every job of this process."""
+        with self._lock:
+            self._connection.execute("UPDATE jobs SET heartbeat = ? WHERE owner = ?", (time.time(), self.owner))
+
+    def release(self) -> None:
+        """Give up the lease on this process's unfinished jobs so that the next process to start resumes them at once."""
+        with self._lock:
+            self._connection.execute("UPDATE jobs SET heartbeat = 0 WHERE owner = ?", (self.owner,))
+
+    def claim_orphaned(self) -> list[JournaledJob]:
+        """Take over the jobs whose owner stopped renewing its lease, oldest first."""
+        now = time.time()
+        claimed = []
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT job_id, user_id, handler, args, record, cache_key, task_ids, owner FROM jobs "
+                "WHERE heartbeat < ? AND owner != ? ORDER BY created_at",
+                (now - self.lease, self.owner)
+            ).fetchall()
+            for job_id, user_id, handler, args, record, cache_key, task_ids, owner in rows:
+                # Another process may claim the same job between the select and the update.
+                cursor = self._connection.execute(
+                    "UPDATE jobs SET owner = ?, heartbeat = ? WHERE job_id = ? AND owner = ?",
+                    (self.owner, now, job_id, owner)
+                )
+                if cursor.rowcount:
+                    claimed.append(JournaledJob(job_id, user_id, handler, json.loads(args), json.loads(record),
+                                                cache_key, json.loads(task_ids)))
+        return claimed
@@ -0,0 +1,108 @@
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable
+
+class QueueFullError(Exception):
+    """Raised when the job queue has reached its maximum depth."""
+
+class UserLimitError(Exception):
+    """Raised when a user already has the maximum number of jobs queued or running."""
+
+class JobQueue:
+    """Bounded queue of inference jobs that serves users round-robin with a fixed pool of workers."""
+
+    def __init__(self, handler: Callable[..., Awaitable[None]], worker_count: int, max_depth: int,
+                 max_user_jobs: int) -> None:
+        self.handler = handler
+        self.worker_count: int = worker_count
+        self.max_depth: int = max_depth
+        self.max_user_jobs: int = max_user_jobs
+        # Users in round-robin order, each with a FIFO of (task_id, args).
+        self._users: OrderedDict[str, deque[tuple[str, tuple]]] = OrderedDict()
+        self._task_users: dict[str, str] = {}
+        self._user_jobs: dict[str, int] = {}
+        self._in_flight: set[str] = set()
+        self._available = asyncio.Semaphore(0)
+        self._workers: list[asyncio.Task] = []
+
+    def start(self) -> None:
+        """Spawn the worker tasks on the running event loop."""
+        for i in range(self.worker_count):
+            self._workers.append(asyncio.create_task(self._worker(), name=f"inference-worker-{i}"))
+
+    async def stop(self) -> None:
+        """Cancel the workers and wait for them to exit."""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+
+    def submit(self, task_id: str, user_id: str, *args) -> int:
+        """Enqueue a job for a user and return its 1-based queue position, or raise QueueFullError/UserLimitError."""
+        if len(self._task_users) >= self.max_depth:
+            raise QueueFullError(f"Job queue is full ({self.max_depth} jobs waiting).")
+        if self._user_jobs.get(user_id, 0) >= self.max_user_jobs:
+            raise UserLimitError(f"User {user_id} already has {self.max_user_jobs} jobs in progress.")
+        return self.requeue(task_id, user_id, *args)
+
+    def requeue(self, task_id: str, user_id: str, *args) -> int:
+        """Enqueue a job that was already accepted once, e.g. before a restart, without checking the queue limits."""
+        self._users.setdefault(user_id, deque()).append((task_id, args))
+        self._task_users[task_id] = user_id
+        self._user_jobs[user_id] = self._user_jobs.get(user_id, 0) + 1
+        self._available.release()
+        return self.position(task_id)
+
+    def position(self, task_id: str) -> int | None:
+        """Return the 1-based position of a waiting job in round-robin serving order, or None if it is not waiting."""
+        user_id = self._task_users.get(task_id)
+        if user_id is None:
+            return None
+        index = next(i for i, (pending_id, _) in enumerate(self._users[user_id]) if pending_id == task_id)
+        # Each round serves one job per user, starting from the front of the rotation.
+        ahead = index
+        user_is_ahead = True
+        for other_id, jobs in self._users.items():
+            if other_id == user_id:
+                user_is_ahead = False
+                continue
+            ahead += min(len(jobs), index + (1 if user_is_ahead else 0))
+        return ahead + 1
+
+    @property
+    def depth(self) -> int:
+        """Number of jobs waiting for a worker."""
+        return len(self._task_users)
+
+    @property
+    def in_flight(self) -> int:
+        """Number of jobs currently being processed."""
+        return len(self._in_flight)
+
+    def _next_job(self) -> tuple[str, str, tuple]:
+        """Take the oldest job of the user at the front of the rotation and move that user to the back."""
+        user_id, jobs = next(iter(self._users.items()))
+        task_id, args = jobs.popleft()
+        if jobs:
+            self._users.move_to_end(user_id)
+        else:
+            del self._users[user_id]
+        del self._task_users[task_id]
+        return user_id, task_id, args
+
+    async def _worker(self) -> None:
+        """Take jobs off the queue one at a time and run the handler."""
+        while True:
+            await self._available.acquire()
+            user_id, task_id, args = self._next_job()
+            self._in_flight.add(task_id)
+            try:
+                await self.handler(task_id, *args)
+            except Exception as e:
+                logging.error("Unhandled error in inference worker for task %s: %s", task_id, e)
+            finally:
+                self._in_flight.discard(task_id)
+                self._user_jobs[user_id] -= 1
+                if not self._user_jobs[user_id]:
+                    del self._user_jobs[user_id]
\ No newline at end of file
@@ -0,0 +1,117 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from content_store import TEMPORARY_FILE_MAX_AGE, link_or_copy, remove_quietly
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def make_cache_key(user_photo_path: str, product_image_path: str, product_description: str, params: dict) -> str:
+    """Hash both input images, the garment description and the inference parameters into one key."""
+    digest = hashlib.sha256()
+    for path in (user_photo_path, product_image_path):
+        with open(path, "rb") as f:
+            while chunk := f.read(HASH_CHUNK_SIZE):
+                digest.update(chunk)
+        digest.update(b"\0")
+    digest.update(product_description.encode('utf-8'))
+    digest.update(json.dumps(params, sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()
+
+class ResultCache:
+    """Size-bounded LRU cache of inference results stored on disk."""
+
+    def __init__(self, directory: str, max_bytes: int) -> None:
+        self.directory: str = directory
+        self.max_bytes: int = max_bytes
+        self.hits: int = 0
+        self.misses: int = 0
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, tuple[str, int]] = OrderedDict()
+        self._size: int = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _load(self) -> None:
+        """Index files left from a previous run, least recently used first, and drop abandoned writes."""
+        files = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                # Renamed into place or evicted by another process meanwhile.
+                continue
+            if name.endswith(".tmp"):
+                # A younger one may be a write another process sharing the directory has in flight.
+                if stat.st_mtime < time.time() - TEMPORARY_FILE_MAX_AGE:
+                    remove_quietly([path])
+            elif os.path.isfile(path):
+                files.append((stat.st_mtime, os.path.splitext(name)[0], path, stat.st_size))
+        for _, key, path, size in sorted(files):
+            self._entries[key] = (path, size)
+            self._size += size
+        self._evict()
+
+    def get(self, key: str) -> str | None:
+        """Return the cached result path for a key and mark it as recently used, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not os.path.exists(entry[0]):
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        os.utime(entry[0])
+        return entry[0]
+
+    def put(self, key: str, source_path: str) -> str:
+        """Link or copy a result file into the cache under the key and return the cached path."""
+        path = os.path.join(self.directory, f"{key}{os.path.splitext(source_path)[1]}")
+        # Replace rather than overwrite: the old file may share its inode with a stored result.
+        temporary_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        link_or_copy(source_path, temporary_path)
+        os.replace(temporary_path, path)
+        size = os.path.getsize(path)
+        with self._lock:
+            if key in self._entries:
+                self._size -= self._entries[key][1]
+            self._entries[key] = (path, size)
+            self._entries.move_to_end(key)
+            self._size += size
+            self._evict()
+        return path
+
+    def stats(self) -> dict:
+        """Return hit/miss counters and current disk usage."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "size_bytes": self._size,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _evict(self) -> None:
+        """Delete least recently used results until the cache fits in max_bytes."""
+        while self._size > self.max_bytes and self._entries:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str) -> None:
+        path, size = self._entries.pop(key)
+        self._size -= size
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.error("Failed to remove cached result %s: %s", path, e)
\ No newline at end of file
@@ -1,42 +1,167 @@
-from fastapi import FastAPI, UploadFile, File, Form, BackgroundTasks
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, UploadFile, File, Form, Request
+from fastapi.responses import FileResponse, JSONResponse, Response
 from logger import setup_logger
-import json
 import os
+import sqlite3
 import uuid
-from gradio_client import Client, file
+from gradio_client import file
 import asyncio
 import logging
 from config import Config
+from file_upload import save_upload_file, UploadValidationError
+from job_queue import JobQueue, QueueFullError, UserLimitError
+from job_journal import JobJournal, JournaledJob
+from task_store import create_task_store
+from task_events import TaskNotifier
+from result_cache import ResultCache, make_cache_key
+from garment_registry import GarmentRegistry
+from catalog import CatalogCache
+from image_preprocessing import make_thumbnail, preprocess_image
+from concurrent.futures import ProcessPoolExecutor
+from PIL import UnidentifiedImageError
+from inference_router import Backend, InferenceRouter, create_client
+from metrics import CONTENT_TYPE, MetricsRegistry
+from content_store import ContentStore
+from contextlib import asynccontextmanager
 import base64
+import time
+import httpx
+
+config = Config()
+setup_logger()
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__)) 
-UPLOAD_DIR = os.path.join(BASE_DIR, 'uploads')
-PROCESSED_DIR = os.path.join(BASE_DIR, 'processed')
+DATA_DIR = config.data_dir or BASE_DIR
+UPLOAD_DIR = os.path.join(DATA_DIR, 'uploads')
+PROCESSED_DIR = os.path.join(DATA_DIR, 'processed')
+STORE_DIR = os.path.join(DATA_DIR, 'store')
+GARMENT_DIR = os.path.join(DATA_DIR, 'garments')
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(PROCESSED_DIR, exist_ok=True)
 
-processing_results = {}
-app = FastAPI()
-config = Config()
-setup_logger()
+# Relative paths of the SQLite files resolve against DATA_DIR, next to the uploads they refer to.
+task_store = create_task_store(config.task_store_backend, os.path.join(DATA_DIR, config.task_store_path),
+                               max_items=config.task_store_max_items, ttl=config.task_ttl)
+job_journal = JobJournal(os.path.join(DATA_DIR, config.job_journal_path), lease=config.job_lease)
+task_notifier = TaskNotifier()
+content_store = ContentStore(STORE_DIR, os.path.join(DATA_DIR, config.storage_index_path),
+                             max_bytes=config.storage_max_bytes, max_age=config.storage_max_age, lease=config.job_lease)
+result_cache = ResultCache(os.path.join(PROCESSED_DIR, 'cache'), max_bytes=config.result_cache_max_bytes)
+thumbnail_cache = ResultCache(os.path.join(PROCESSED_DIR, 'thumbs'), max_bytes=config.thumbnail_cache_max_bytes)
+catalog = CatalogCache(config.js_data_url)
+garment_registry = GarmentRegistry(GARMENT_DIR, catalog, max_side=config.preprocess_max_side)
+preprocess_pool = ProcessPoolExecutor(max_workers=config.preprocess_workers)
+
+inflight_tasks: dict[str, list[str]] = {}
+# Bounds concurrent /tryon calls across all jobs, including the items a batch runs side by side.
+inference_slots = asyncio.Semaphore(config.inference_workers)
+
+FINAL_STATUSES = ('completed', 'error')
+INFERENCE_PARAMS = {'is_checked': True, 'is_checked_crop': False, 'seed': 42}
+PREVIEW_QUALITY = 'preview'
 
-gradio_client = Client(config.model_name, hf_token=config.model_name)
+inference_router = InferenceRouter(
+    [Backend(spec, lambda spec=spec: create_client(spec, config.ht_token)) for spec in config.model_names],
+    max_failures=config.backend_max_failures,
+    base_backoff=config.backend_base_backoff,
+    max_backoff=config.backend_max_backoff,
+    max_attempts=config.inference_max_attempts,
+)
+
+metrics = MetricsRegistry()
+metrics.gauge("tryon_queue_depth", "Jobs waiting for an inference worker.", function=lambda: job_queue.depth)
+metrics.gauge("tryon_jobs_in_flight", "Jobs currently being processed by an inference worker.",
+              function=lambda: job_queue.in_flight)
+metrics.gauge("tryon_storage_bytes", "Bytes held by the content-addressed upload and result store.",
+              function=lambda: content_store.size)
+stage_seconds = metrics.histogram("tryon_stage_seconds", "Time spent in each stage of handling a try-on.", ("stage",))
+errors_total = metrics.counter("tryon_errors_total", "Errors raised while handling try-ons, by exception type.", ("type",))
+http_requests_total = metrics.counter("http_requests_total", "HTTP requests by method, route and status code.",
+                                      ("method", "route", "status"))
+http_request_seconds = metrics.histogram("http_request_duration_seconds", "Time until the response headers are sent.",
+                                         ("method", "route"))
+request_bytes_total = metrics.counter("http_request_bytes_total", "Request body bytes received, by route.", ("route",))
+response_bytes_total = metrics.counter("http_response_bytes_total", "Response body bytes sent, by route.", ("route",))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    job_queue.start()
+    job_recovery = asyncio.create_task(run_job_recovery(config.job_heartbeat_interval))
+    garment_sync = asyncio.create_task(garment_registry.sync())
+    storage_collector = asyncio.create_task(content_store.run_collector(config.storage_gc_interval))
+    yield
+    job_recovery.cancel()
+    garment_sync.cancel()
+    storage_collector.cancel()
+    await job_queue.stop()
+    job_journal.release()
+    preprocess_pool.shutdown(cancel_futures=True)
+
+app = FastAPI(lifespan=lifespan)
+
+@app.middleware("http")
+async def limit_request_size(request: Request, call_next):
+    """Refuse a request whose declared body exceeds MAX_REQUEST_SIZE before any of it is received or parsed."""
+    content_length = request.headers.get('content-length', '')
+    if content_length.isdigit() and int(content_length) > config.max_request_size:
+        return JSONResponse(content={"error": f"Request exceeds {config.max_request_size} bytes."}, status_code=413,
+                            headers={"Connection": "close"})
+    return await call_next(request)
+
+@app.middleware("http")
+async def record_http_metrics(request: Request, call_next):
+    """Count every request with its duration and the bytes received and sent, labelled by route template."""
+    started = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get('route')
+    route_path = route.path if route is not None else 'unmatched'
+    http_request_seconds.observe(time.perf_counter() - started, method=request.method, route=route_path)
+    http_requests_total.inc(method=request.method, route=route_path, status=response.status_code)
+    request_bytes_total.inc(int(request.headers.get('content-length', 0)), route=route_path)
+    response_bytes_total.inc(int(response.headers.get('content-length', 0)), route=route_path)
+    return response
 
 @app.get("/")
 async def read_root():
     return {"message": "Hello, API Server"}
 
 @app.get("/products/")
-async def get_products():
-    """Fetch products from the JSON file."""
+async def get_products(request: Request, offset: int = 0, limit: int | None = None, q: str | None = None,
+                       model: str | None = None, color: str | None = None):
+    """Serve the cached product catalog, or a page of the products matching the model and color filters and the text search q with the match count in X-Total-Count, answering 304 when the client's copy is still current."""
+    if offset < 0 or (limit is not None and not 1 <= limit <= config.catalog_max_page_size):
+        return JSONResponse(content={"error": f"Offset must not be negative and limit must be between 1 and "
+                                              f"{config.catalog_max_page_size}."}, status_code=422)
     try:
-        with open(config.js_data_url, 'r', encoding='utf-8') as f:
-            products = json.load(f)
-        return JSONResponse(content=products)
+        snapshot = catalog.get()
     except Exception as e:
+        errors_total.inc(type=type(e).__name__)
+        logging.error("Error with loading product from json: %s", e)
         return JSONResponse(content={"error": "Error with loading product from json."}, status_code=500)
 
+    # A page depends only on the catalog version and its query string, so it shares the validators of the whole catalog.
+    headers = {"ETag": snapshot.etag, "Last-Modified": snapshot.last_modified, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") is not None:
+        if etag_matches(request, snapshot.etag):
+            return Response(status_code=304, headers=headers)
+    elif request.headers.get("if-modified-since") == snapshot.last_modified:
+        return Response(status_code=304, headers=headers)
+
+    if offset == 0 and limit is None and not (q or model or color):
+        headers["X-Total-Count"] = str(len(snapshot.products))
+        return Response(content=snapshot.body, media_type="application/json", headers=headers)
+    positions = snapshot.index.search(q, model, color)
+    headers["X-Total-Count"] = str(len(positions))
+    end = offset + limit if limit is not None else None
+    return JSONResponse(content=[snapshot.products[position] for position in positions[offset:end]], headers=headers)
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Whether the request's If-None-Match header names the given entity tag."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is None:
+        return False
+    return etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*"
+
 @app.post("/upload/")
 async def upload_file(
     user_photo: str = Form(...),
@@ -44,78 +169,615 @@ async def upload_file(
     product_image: str = Form(...),
     product_image_extension: str = Form(...),
     product_description: str = Form(...),
-    background_tasks: BackgroundTasks = BackgroundTasks()
+    user_id: str | None = Form(None),
+    quality: str = Form("full"),
+    progressive: bool = Form(False)
 ):
+    if quality not in config.quality_tiers:
+        return JSONResponse(content={"error": f"Unknown quality tier {quality}."}, status_code=422)
     task_id = str(uuid.uuid4())
+    saved_paths = []
 
     try:
-        user_photo_bytes = base64.b64decode(user_photo)
-        product_image_bytes = base64.b64decode(product_image)
+        with stage_seconds.time(stage='decode'):
+            user_photo_bytes = base64.b64decode(user_photo)
+            product_image_bytes = base64.b64decode(product_image)
         
         user_photo_path = os.path.join(UPLOAD_DIR, f"{task_id}_user_photo{user_photo_extension}")
         product_image_path = os.path.join(UPLOAD_DIR, f"{task_id}_product_image{product_image_extension}")
 
-        with open(user_photo_path, "wb") as f:
-            f.write(user_photo_bytes)
+        with stage_seconds.time(stage='write'):
+            saved_paths.append(user_photo_path)
+            with open(user_photo_path, "wb") as f:
+                f.write(user_photo_bytes)
+
+            saved_paths.append(product_image_path)
+            with open(product_image_path, "wb") as f:
+                f.write(product_image_bytes)
+
+        saved_paths[0] = user_photo_path = await preprocess_upload(user_photo_path)
+        saved_paths[1] = product_image_path = await preprocess_upload(product_image_path)
+
+        return await enqueue_task(task_id, user_photo_path, product_image_path, product_description,
+                                  saved_paths, user_id, quality, progressive)
+
+    except Exception as e:
+        errors_total.inc(type=type(e).__name__)
+        logging.error("Loading files server error: %s", e)
+        await release_files(saved_paths)
+        return JSONResponse(content={"error": "Loading files server error."}, status_code=500)
+
+@app.post("/upload/files/")
+async def upload_binary_files(
+    user_photo: UploadFile = File(...),
+    product_image: UploadFile | None = File(None),
+    product_id: int | None = Form(None),
+    product_description: str | None = Form(None),
+    user_id: str | None = Form(None),
+    quality: str = Form("full"),
+    progressive: bool = Form(False)
+):
+    """Accept raw multipart image parts, or a product_id from the garment registry, and stream them to disk."""
+    if quality not in config.quality_tiers:
+        return JSONResponse(content={"error": f"Unknown quality tier {quality}."}, status_code=422)
+    task_id = str(uuid.uuid4())
+    saved_paths = []
+
+    try:
+        if product_id is not None:
+            product_image_path = await garment_registry.get_path(product_id)
+            if product_image_path is None:
+                return JSONResponse(content={"error": f"Product {product_id} not found."}, status_code=404)
+            if product_description is None:
+                product_description = garment_registry.description(product_id)
+        elif product_image is None or product_description is None:
+            return JSONResponse(content={"error": "Send product_id or product_image with product_description."},
+                                status_code=422)
+
+        user_photo_path = await store_upload(user_photo, f"{task_id}_user_photo")
+        saved_paths.append(user_photo_path)
+        user_photo_path = await preprocess_upload(user_photo_path)
+        saved_paths[-1] = user_photo_path
+        if product_id is None:
+            product_image_path = await store_upload(product_image, f"{task_id}_product_image")
+            saved_paths.append(product_image_path)
+            product_image_path = await preprocess_upload(product_image_path)
+            saved_paths[-1] = product_image_path
+
+        return await enqueue_task(task_id, user_photo_path, product_image_path, product_description, saved_paths, user_id,
+                                  quality, progressive)
 
-        with open(product_image_path, "wb") as f:
-            f.write(product_image_bytes)
+    except UploadValidationError as e:
+        errors_total.inc(type=type(e).__name__)
+        await release_files(saved_paths)
+        return JSONResponse(content={"error": e.message}, status_code=e.status_code)
 
-        background_tasks.add_task(process_files, task_id, user_photo_path, product_image_path, product_description)
+    except UnidentifiedImageError as e:
+        errors_total.inc(type=type(e).__name__)
+        logging.warning("Rejecting undecodable image for task %s: %s", task_id, e)
+        await release_files(saved_paths)
+        return JSONResponse(content={"error": "Image could not be decoded."}, status_code=415)
 
-        return JSONResponse(content={"task_id": task_id, "message": "Files loading and started processing."})
+    except httpx.HTTPError as e:
+        errors_total.inc(type=type(e).__name__)
+        logging.error("Failed to fetch garment image for product %s: %s", product_id, e)
+        await release_files(saved_paths)
+        return JSONResponse(content={"error": "Garment image is unavailable."}, status_code=502)
 
     except Exception as e:
+        errors_total.inc(type=type(e).__name__)
         logging.error("Loading files server error: %s", e)
+        await release_files(saved_paths)
         return JSONResponse(content={"error": "Loading files server error."}, status_code=500)
 
+@app.post("/upload/batch/")
+async def upload_batch(
+    user_photo: UploadFile = File(...),
+    product_ids: list[int] = Form(...),
+    user_id: str | None = Form(None),
+    quality: str = Form("full")
+):
+    """Accept one user photo with several catalog product ids and try every garment on it in a single job."""
+    if quality not in config.quality_tiers:
+        return JSONResponse(content={"error": f"Unknown quality tier {quality}."}, status_code=422)
+    product_ids = list(dict.fromkeys(product_ids))
+    if len(product_ids) > config.batch_max_items:
+        return JSONResponse(content={"error": f"At most {config.batch_max_items} products can be tried on at once."},
+                            status_code=422)
+    task_id = str(uuid.uuid4())
+    saved_paths = []
+
+    try:
+        garment_paths = await asyncio.gather(*(garment_registry.get_path(product_id) for product_id in product_ids))
+        missing_ids = [product_id for product_id, path in zip(product_ids, garment_paths) if path is None]
+        if missing_ids:
+            return JSONResponse(content={"error": f"Products {missing_ids} not found."}, status_code=404)
+        garments = [(product_id, path, garment_registry.description(product_id))
+                    for product_id, path in zip(product_ids, garment_paths)]
+
+        user_photo_path = await store_upload(user_photo, f"{task_id}_user_photo")
+        saved_paths.append(user_photo_path)
+        user_photo_path = await preprocess_upload(user_photo_path)
+        saved_paths[-1] = user_photo_path
+
+        position = submit_job(task_id, user_id or task_id,
+                              {'status': 'queued', 'job_id': task_id,
+                               'items': [{'product_id': product_id, 'status': 'queued'} for product_id in product_ids]},
+                              process_batch, user_photo_path, garments, quality)
+        return JSONResponse(content={"task_id": task_id, "position": position,
+                                     "message": "Files loading and started processing."})
+
+    except QueueFullError as e:
+        errors_total.inc(type=type(e).__name__)
+        logging.warning("Rejecting batch %s: %s", task_id, e)
+        await release_files(saved_paths)
+        return JSONResponse(content={"error": "Server is busy, try again later."}, status_code=503,
+                            headers={"Retry-After": str(config.queue_retry_after)})
+
+    except UserLimitError as e:
+        errors_total.inc(type=type(e).__name__)
+        logging.warning("Rejecting batch %s: %s", task_id, e)
+        await release_files(saved_paths)
+        return JSONResponse(content={"error": "Too many jobs in progress for this user."}, status_code=429,
+                            headers={"Retry-After": str(config.queue_retry_after)})
+
+    except UploadValidationError as e:
+        errors_total.inc(type=type(e).__name__)
+        await release_files(saved_paths)
+        return JSONResponse(content={"error": e.message}, status_code=e.status_code)
+
+    except UnidentifiedImageError as e:
+        errors_total.inc(type=type(e).__name__)
+        logging.warning("Rejecting undecodable image for batch %s: %s", task_id, e)
+        await release_files(saved_paths)
+        return JSONResponse(content={"error": "Image could not be decoded."}, status_code=415)
+
+    except httpx.HTTPError as e:
+        errors_total.inc(type=type(e).__name__)
+        logging.error("Failed to fetch garment images for batch %s: %s", task_id, e)
+        await release_files(saved_paths)
+        return JSONResponse(content={"error": "Garment image is unavailable."}, status_code=502)
+
+    except Exception as e:
+        errors_total.inc(type=type(e).__name__)
+        logging.error("Loading files server error: %s", e)
+        await release_files(saved_paths)
+        return JSONResponse(content={"error": "Loading files server error."}, status_code=500)
+
+async def store_upload(upload: UploadFile, name: str) -> str:
+    """Stream an uploaded part into UPLOAD_DIR with the configured size limit."""
+    with stage_seconds.time(stage='write'):
+        return await save_upload_file(upload, UPLOAD_DIR, name, config.max_upload_size)
+
+async def preprocess_upload(path: str) -> str:
+    """Normalise an uploaded image in the process pool and move it into the content store, holding a reference for the job."""
+    loop = asyncio.get_running_loop()
+    with stage_seconds.time(stage='preprocess'):
+        path = await loop.run_in_executor(preprocess_pool, preprocess_image, path,
+                                          config.preprocess_max_side, config.preprocess_jpeg_quality)
+    with stage_seconds.time(stage='write'):
+        return await asyncio.to_thread(content_store.add, path, True)
+
+async def store_result(path: str, move: bool = False) -> str:
+    """Put a result image into the content store without holding it, so the collector may evict it once it ages out."""
+    with stage_seconds.time(stage='write'):
+        return await asyncio.to_thread(content_store.add, path, move, False)
+
+def remove_files(paths: list[str]) -> None:
+    """Delete files that are no longer needed, ignoring ones already gone."""
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+async def release_stored(path: str) -> None:
+    """Drop a reference to a stored file off the event loop; if the index stays locked the file is only kept until this process stops."""
+    try:
+        await asyncio.to_thread(content_store.release, path)
+    except sqlite3.Error as e:
+        errors_total.inc(type=type(e).__name__)
+        logging.error("Failed to release stored file %s: %s", path, e)
+
+async def release_files(paths: list[str]) -> None:
+    """Release the references a job held on stored files and delete scratch files that never reached the store."""
+    for path in paths:
+        if await asyncio.to_thread(content_store.owns, path):
+            await release_stored(path)
+        else:
+            remove_files([path])
+
+def inference_params(quality: str) -> dict:
+    """Return the /tryon arguments for a quality tier."""
+    return {**INFERENCE_PARAMS, **config.quality_tiers[quality]}
+
+async def result_cache_key(user_photo_path: str, product_image_path: str, product_description: str,
+                           quality: str) -> str:
+    """Hash the inputs and tier parameters of a try-on into its result cache key."""
+    with stage_seconds.time(stage='hash'):
+        return await asyncio.to_thread(make_cache_key, user_photo_path, product_image_path, product_description,
+                                       inference_params(quality))
+
+async def enqueue_task(task_id: str, user_photo_path: str, product_image_path: str, product_description: str,
+                       uploaded_paths: list[str], user_id: str | None, quality: str, progressive: bool) -> JSONResponse:
+    """Answer from the result cache, or put a stored upload on the user's inference queue and reject it with Retry-After when the queue or the user's quota is full."""
+    cache_key = await result_cache_key(user_photo_path, product_image_path, product_description, quality)
+    cached_path = result_cache.get(cache_key)
+    if cached_path is not None:
+        try:
+            result_path = await store_result(cached_path)
+            await release_files(uploaded_paths)
+            finish_task(task_id, {'status': 'completed', 'result_path': result_path})
+            return JSONResponse(content={"task_id": task_id, "position": 0,
+                                         "message": "Result found in cache."})
+        except OSError as e:
+            errors_total.inc(type=type(e).__name__)
+            logging.error("Failed to reuse cached result for task %s: %s", task_id, e)
+
+    waiting_tasks = inflight_tasks.get(cache_key)
+    if waiting_tasks is not None:
+        job_id = waiting_tasks[0]
+        waiting_tasks.append(task_id)
+        task_store.set(task_id, task_store.get(job_id) or {'status': 'queued', 'job_id': job_id})
+        job_journal.attach(job_id, task_id)
+        await release_files(uploaded_paths)
+        return JSONResponse(content={"task_id": task_id, "position": job_queue.position(job_id) or 0,
+                                     "message": "Files loading and started processing."})
+
+    try:
+        # Requests without a user id are each scheduled as their own user.
+        position = submit_job(task_id, user_id or task_id, {'status': 'queued', 'job_id': task_id},
+                              process_files, user_photo_path, product_image_path, product_description, cache_key,
+                              quality, progressive and quality != PREVIEW_QUALITY, cache_key=cache_key)
+    except QueueFullError as e:
+        errors_total.inc(type=type(e).__name__)
+        logging.warning("Rejecting task %s: %s", task_id, e)
+        await release_files(uploaded_paths)
+        return JSONResponse(content={"error": "Server is busy, try again later."}, status_code=503,
+                            headers={"Retry-After": str(config.queue_retry_after)})
+    except UserLimitError as e:
+        errors_total.inc(type=type(e).__name__)
+        logging.warning("Rejecting task %s: %s", task_id, e)
+        await release_files(uploaded_paths)
+        return JSONResponse(content={"error": "Too many jobs in progress for this user."}, status_code=429,
+                            headers={"Retry-After": str(config.queue_retry_after)})
+
+    return JSONResponse(content={"task_id": task_id, "position": position,
+                                 "message": "Files loading and started processing."})
+
+def submit_job(task_id: str, user_id: str, record: dict, handler, *args, cache_key: str | None = None) -> int:
+    """Journal a job so that it survives a restart, put it on the user's inference queue and store its queued task record."""
+    job_journal.add(task_id, user_id, handler.__name__, args, record, cache_key)
+    try:
+        position = job_queue.submit(task_id, user_id, handler, *args)
+    except Exception:
+        job_journal.remove(task_id)
+        raise
+    if cache_key is not None:
+        inflight_tasks[cache_key] = [task_id]
+    task_store.set(task_id, record)
+    return position
+
+async def resume_jobs(jobs: list[JournaledJob]) -> None:
+    """Queue journaled jobs taken over from a stopped process again, restoring their task records and the references to their stored uploads."""
+    for job in jobs:
+        handler = JOB_HANDLERS.get(job.handler)
+        if handler is None:
+            logging.error("Dropping journaled job %s with unknown handler %s", job.job_id, job.handler)
+            job_journal.remove(job.job_id)
+            continue
+        # Only string arguments can be paths; retain() ignores everything the store does not hold.
+        for arg in job.args:
+            if isinstance(arg, str):
+                try:
+                    await asyncio.to_thread(content_store.retain, arg)
+                except sqlite3.Error as e:
+                    errors_total.inc(type=type(e).__name__)
+                    logging.error("Failed to retain %s for resumed job %s: %s", arg, job.job_id, e)
+        if job.cache_key is not None:
+            inflight_tasks[job.cache_key] = job.task_ids
+        for waiting_id in job.task_ids:
+            task_store.set(waiting_id, job.record)
+            task_notifier.notify(waiting_id)
+        job_queue.requeue(job.job_id, job.user_id, handler, *job.args)
+        logging.info("Resumed journaled job %s for %d tasks", job.job_id, len(job.task_ids))
+
+async def run_job_recovery(interval: float) -> None:
+    """Renew the lease on this process's journaled jobs and stored file references, and resume the jobs left by processes that stopped, every interval seconds."""
+    while True:
+        try:
+            await asyncio.to_thread(job_journal.heartbeat)
+            await asyncio.to_thread(content_store.heartbeat)
+            await resume_jobs(await asyncio.to_thread(job_journal.claim_orphaned))
+        except Exception as e:
+            errors_total.inc(type=type(e).__name__)
+            logging.error("Job journal recovery failed: %s", e)
+        await asyncio.sleep(interval)
+
+def finish_task(task_id: str, record: dict) -> None:
+    """Store the final state of a task and wake up long-polling clients."""
+    task_store.set(task_id, record)
+    task_notifier.notify(task_id)
+
+def update_job(task_id: str, cache_key: str | None, record: dict) -> None:
+    """Store a state record for a job and every task coalesced onto it."""
+    for waiting_id in inflight_tasks.get(cache_key, [task_id]):
+        task_store.set(waiting_id, record)
+
+def publish_preview(task_id: str, cache_key: str | None, preview_path: str) -> None:
+    """Attach a preview image to a running job and wake up long-polling clients so they can show it."""
+    update_job(task_id, cache_key, {'status': 'processing', 'job_id': task_id, 'preview_path': preview_path})
+    for waiting_id in inflight_tasks.get(cache_key, [task_id]):
+        task_notifier.notify(waiting_id)
+
+def finish_job(task_id: str, cache_key: str | None, record: dict) -> None:
+    """Fan the final state of a job out to every task coalesced onto it."""
+    for waiting_id in inflight_tasks.pop(cache_key, [task_id]):
+        finish_task(waiting_id, record)
+
+async def run_tryon(user_photo_path: str, product_image_path: str, product_description: str, quality: str) -> str:
+    """Run one /tryon call for a quality tier, waiting for one of the INFERENCE_WORKERS inference slots, and move the result into the content store."""
+    async with inference_slots:
+        with stage_seconds.time(stage='predict'):
+            result_gradio = await inference_router.predict(
+                dict={"background": file(user_photo_path)},
+                garm_img=file(product_image_path),
+                garment_des=product_description,
+                api_name="/tryon",
+                **inference_params(quality)
+            )
+
+    # The client leaves its downloads in a temporary directory that nothing else cleans up.
+    remove_files(list(result_gradio[1:]))
+    return await store_result(result_gradio[0], move=True)
+
 async def process_files(task_id: str, user_photo_path: str, product_image_path: str,
-                        product_description: str):
-    processing_results[task_id] = {'status': 'processing'}
+                        product_description: str, cache_key: str | None = None, quality: str = 'full',
+                        progressive: bool = False):
+    update_job(task_id, cache_key, {'status': 'processing', 'job_id': task_id})
 
     try:
         if not os.path.exists(user_photo_path):
-            processing_results[task_id] = {'status': 'error', 'message': f"File {user_photo_path} not found."}
+            finish_job(task_id, cache_key, {'status': 'error', 'message': f"File {user_photo_path} not found."})
             return
         
         if not os.path.exists(product_image_path):
-            processing_results[task_id] = {'status': 'error', 'message': f"File {product_image_path} not found."}
+            finish_job(task_id, cache_key, {'status': 'error', 'message': f"File {product_image_path} not found."})
             return
 
-        result_gradio = await asyncio.to_thread(gradio_client.predict,
-            dict={"background": file(user_photo_path)},
-            garm_img=file(product_image_path),
-            garment_des=product_description,
-            is_checked=True,
-            is_checked_crop=False,
-            denoise_steps=30,
-            seed=42,
-            api_name="/tryon"
-        )
-        
-        image_path = result_gradio[0]
-        with open(image_path, "rb") as img_file:
-            processed_image_data = img_file.read()
-
-        processed_image_extension = os.path.splitext(image_path)[1]
-        processed_image_base64 = base64.b64encode(processed_image_data).decode('utf-8')
+        if progressive:
+            preview_key = await result_cache_key(user_photo_path, product_image_path, product_description, PREVIEW_QUALITY)
+            cached_preview_path = result_cache.get(preview_key)
+            if cached_preview_path is not None:
+                preview_path = await store_result(cached_preview_path)
+            else:
+                preview_path = await run_tryon(user_photo_path, product_image_path, product_description, PREVIEW_QUALITY)
+                await asyncio.to_thread(result_cache.put, preview_key, preview_path)
+            publish_preview(task_id, cache_key, preview_path)
 
-        final_processed_image_path = os.path.join(PROCESSED_DIR, f"{task_id}_result{processed_image_extension}")
-        with open(final_processed_image_path, "wb") as f:
-            f.write(processed_image_data)
+        final_processed_image_path = await run_tryon(user_photo_path, product_image_path, product_description, quality)
+        if cache_key is not None:
+            await asyncio.to_thread(result_cache.put, cache_key, final_processed_image_path)
 
-        processing_results[task_id] = {'status': 'completed', 'result': processed_image_base64}
+        finish_job(task_id, cache_key, {'status': 'completed', 'result_path': final_processed_image_path})
 
     except Exception as e:
+        errors_total.inc(type=type(e).__name__)
         logging.error("Error during processing for task %s: %s", task_id, e)
-        processing_results[task_id] = {'status': 'error', 'message': "Error with processing images."}
+        finish_job(task_id, cache_key, {'status': 'error', 'message': "Error with processing images."})
 
-@app.get("/status/{task_id}") 
-async def get_status(task_id: str): 
-    if task_id in processing_results: 
-        return JSONResponse(
-            content={"status": processing_results[task_id]['status'], 
-                     "result": processing_results[task_id].get('result') }) 
+    finally:
+        # The garment may come from the registry rather than the store; release() ignores such paths.
+        await release_stored(user_photo_path)
+        await release_stored(product_image_path)
+
+async def process_batch(task_id: str, user_photo_path: str, garments: list[tuple[int, str, str]], quality: str):
+    """Try several garments on one user photo, running up to batch_concurrency of them at once within the shared inference slots and publishing each result as it finishes."""
+    items = [{'product_id': product_id, 'status': 'queued'} for product_id, _, _ in garments]
+    task_store.set(task_id, {'status': 'processing', 'job_id': task_id, 'items': list(items)})
+
+    if not os.path.exists(user_photo_path):
+        await release_stored(user_photo_path)
+        finish_task(task_id, {'status': 'error', 'message': f"File {user_photo_path} not found.", 'items': items})
+        return
+
+    semaphore = asyncio.Semaphore(config.batch_concurrency)
+
+    async def run_item(index: int, product_id: int, product_image_path: str, product_description: str) -> None:
+        async with semaphore:
+            try:
+                cache_key = await result_cache_key(user_photo_path, product_image_path, product_description, quality)
+                cached_path = result_cache.get(cache_key)
+                if cached_path is not None:
+                    result_path = await store_result(cached_path)
+                else:
+                    result_path = await run_tryon(user_photo_path, product_image_path, product_description, quality)
+                    await asyncio.to_thread(result_cache.put, cache_key, result_path)
+                items[index] = {'product_id': product_id, 'status': 'completed', 'result_path': result_path}
+            except Exception as e:
+                errors_total.inc(type=type(e).__name__)
+                logging.error("Error during processing of product %s for batch %s: %s", product_id, task_id, e)
+                items[index] = {'product_id': product_id, 'status': 'error', 'message': "Error with processing images."}
+        task_store.set(task_id, {'status': 'processing', 'job_id': task_id, 'items': list(items)})
+        task_notifier.notify(task_id)
+
+    await asyncio.gather(*(run_item(index, *garment) for index, garment in enumerate(garments)))
+    await release_stored(user_photo_path)
+    status = 'completed' if any(item['status'] == 'completed' for item in items) else 'error'
+    finish_task(task_id, {'status': status, 'items': items})
+
+async def run_job(task_id: str, handler, *args) -> None:
+    """Dispatch a queued job to the handler it was submitted with and drop it from the journal once it has run."""
+    cancelled = False
+    try:
+        await handler(task_id, *args)
+    except asyncio.CancelledError:
+        # The server is shutting down: keep the job journaled so that the next start resumes it.
+        cancelled = True
+        raise
+    finally:
+        if not cancelled:
+            job_journal.remove(task_id)
+
+JOB_HANDLERS = {handler.__name__: handler for handler in (process_files, process_batch)}
+
+job_queue = JobQueue(run_job, worker_count=config.inference_workers, max_depth=config.max_queue_depth,
+                     max_user_jobs=config.max_user_jobs)
+
+def read_result_base64(result_path: str) -> str:
+    """Read a stored result image from disk and encode it for the JSON status response."""
+    content_store.touch(result_path)
+    with stage_seconds.time(stage='result_read'):
+        with open(result_path, "rb") as img_file:
+            result_bytes = img_file.read()
+    with stage_seconds.time(stage='encode'):
+        return base64.b64encode(result_bytes).decode('utf-8')
+
+async def render_batch_items(task_id: str, record: dict, inline: bool) -> list[dict]:
+    """Render the items of a batch task with result URLs, embedding the images once the whole batch has finished if inline is set."""
+    rendered_items = []
+    for index, item in enumerate(record['items']):
+        rendered = {"product_id": item['product_id'], "status": item['status']}
+        if item['status'] == 'completed':
+            rendered["result_url"] = f"/result/{task_id}?item={index}"
+        if inline and item['status'] == 'completed' and record['status'] == 'completed':
+            try:
+                rendered["result"] = await asyncio.to_thread(read_result_base64, item['result_path'])
+            except OSError as e:
+                errors_total.inc(type=type(e).__name__)
+                logging.error("Stored result of product %s for batch %s is unavailable: %s", item['product_id'], task_id, e)
+                rendered["status"] = 'error'
+        rendered_items.append(rendered)
+    return rendered_items
+
+def finished_items(record: dict) -> int:
+    """Count the items of a batch task that have finished, successfully or not."""
+    return sum(item['status'] in FINAL_STATUSES for item in record.get('items', []))
+
+async def build_status_response(task_id: str, record: dict | None, inline: bool = False) -> JSONResponse:
+    """Render a task record as the JSON body shared by the status endpoints, linking result images by URL and embedding them only if inline is set."""
+    if record is not None: 
+        content = {"status": record['status'], "result": None}
+        if record.get('preview_path') and record['status'] == 'processing':
+            content["preview_url"] = f"/result/{task_id}?preview=true"
+            content["preview_thumbnail_url"] = f"/result/{task_id}?preview=true&size=thumb"
+            if inline:
+                try:
+                    content["preview"] = await asyncio.to_thread(read_result_base64, record['preview_path'])
+                except OSError as e:
+                    errors_total.inc(type=type(e).__name__)
+                    logging.error("Stored preview for task %s is unavailable: %s", task_id, e)
+        if record['status'] == 'completed' and 'items' not in record:
+            try:
+                if inline:
+                    content["result"] = await asyncio.to_thread(read_result_base64, record['result_path'])
+                elif not os.path.exists(record['result_path']):
+                    raise FileNotFoundError(record['result_path'])
+            except OSError as e:
+                errors_total.inc(type=type(e).__name__)
+                logging.error("Stored result for task %s is unavailable: %s", task_id, e)
+                return JSONResponse(content={"status": "not found"}, status_code=404)
+            content["result_url"] = f"/result/{task_id}"
+            content["thumbnail_url"] = f"/result/{task_id}?size=thumb"
+        elif record['status'] == 'queued':
+            content["position"] = job_queue.position(record.get('job_id', task_id))
+        if 'items' in record:
+            content["items"] = await render_batch_items(task_id, record, inline)
+        return JSONResponse(content=content) 
     else: 
         return JSONResponse(content={"status": "not found"}, status_code=404)
+
+@app.get("/backends/")
+async def get_backends():
+    """Report load, latency and error statistics of each inference backend."""
+    return JSONResponse(content=inference_router.stats())
+
+@app.get("/cache/stats/")
+async def get_cache_stats():
+    """Report result cache hit/miss counters and disk usage."""
+    return JSONResponse(content=result_cache.stats())
+
+@app.get("/storage/stats/")
+async def get_storage_stats():
+    """Report disk usage, references, deduplication savings and evictions of the upload and result store."""
+    return JSONResponse(content=await asyncio.to_thread(content_store.stats))
+
+@app.get("/metrics")
+async def get_metrics():
+    """Expose queue, stage latency, error and traffic metrics in the Prometheus text format."""
+    return Response(content=metrics.render(), media_type=CONTENT_TYPE)
+
+def stored_result_path(record: dict | None, item: int | None, preview: bool) -> str | None:
+    """Find the stored image a /result request refers to, or None if the task has no such image yet."""
+    if record is None:
+        return None
+    if preview:
+        return record.get('preview_path')
+    if item is not None:
+        items = record.get('items') or []
+        if 0 <= item < len(items) and items[item]['status'] == 'completed':
+            return items[item]['result_path']
+        return None
+    return record.get('result_path') if record['status'] == 'completed' else None
+
+async def thumbnail_path(source_path: str) -> str:
+    """Return the cached thumbnail of a stored image, generating it in the process pool on first use."""
+    key = f"{os.path.splitext(os.path.basename(source_path))[0]}_thumb{config.thumbnail_max_side}"
+    cached_path = thumbnail_cache.get(key)
+    if cached_path is not None:
+        return cached_path
+    temporary_path = os.path.join(UPLOAD_DIR, f"{uuid.uuid4()}_thumb.jpg")
+    loop = asyncio.get_running_loop()
+    try:
+        with stage_seconds.time(stage='thumbnail'):
+            await loop.run_in_executor(preprocess_pool, make_thumbnail, source_path, temporary_path,
+                                       config.thumbnail_max_side, config.thumbnail_jpeg_quality)
+        return await asyncio.to_thread(thumbnail_cache.put, key, temporary_path)
+    finally:
+        remove_files([temporary_path])
+
+@app.get("/result/{task_id}")
+async def get_result(request: Request, task_id: str, size: str = "full", item: int | None = None,
+                     preview: bool = False):
+    """Stream a stored result image, or a cached thumbnail of it, with ETag, Content-Length and range support."""
+    if size not in ("full", "thumb"):
+        return JSONResponse(content={"error": f"Unknown size {size}."}, status_code=422)
+    path = stored_result_path(task_store.get(task_id), item, preview)
+    if path is None or not os.path.exists(path):
+        return JSONResponse(content={"status": "not found"}, status_code=404)
+
+    await asyncio.to_thread(content_store.touch, path)
+    if size == "thumb":
+        try:
+            path = await thumbnail_path(path)
+        except OSError as e:
+            errors_total.inc(type=type(e).__name__)
+            logging.error("Failed to create thumbnail for task %s: %s", task_id, e)
+            return JSONResponse(content={"status": "not found"}, status_code=404)
+
+    # Stored files are named after the hash of their content, which makes the name a strong validator.
+    headers = {"ETag": f'"{os.path.splitext(os.path.basename(path))[0]}"', "Cache-Control": "private, max-age=86400"}
+    if etag_matches(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, headers=headers)
+
+@app.get("/status/{task_id}") 
+async def get_status(task_id: str, inline: bool = False): 
+    return await build_status_response(task_id, task_store.get(task_id), inline)
+
+@app.get("/status/{task_id}/wait")
+async def wait_status(task_id: str, timeout: float = 25.0, known_preview: bool = False, known_finished: int = 0,
+                      inline: bool = False):
+    """Long-poll the task status, answering as soon as the task completes, fails, has a new preview or finishes another batch item, or when the timeout expires."""
+    deadline = asyncio.get_running_loop().time() + max(0.0, min(timeout, config.long_poll_max_timeout))
+    record = task_store.get(task_id)
+    while record is not None and record['status'] not in FINAL_STATUSES and (
+            known_preview or not record.get('preview_path')) and finished_items(record) <= known_finished:
+        remaining = deadline - asyncio.get_running_loop().time()
+        if remaining <= 0:
+            break
+        # Re-check the store periodically: another server process may finish the task.
+        await task_notifier.wait(task_id, min(remaining, config.long_poll_recheck_interval))
+        record = task_store.get(task_id)
+    return await build_status_response(task_id, record, inline)
     
\ No newline at end of file
@@ -0,0 +1,30 @@
+import asyncio
+
+class TaskNotifier:
+    """Wakes up requests that are waiting for a task to reach a final state."""
+
+    def __init__(self) -> None:
+        self._events: dict[str, asyncio.Event] = {}
+        self._waiters: dict[str, int] = {}
+
+    async def wait(self, task_id: str, timeout: float) -> bool:
+        """Wait until the task is notified or the timeout expires; return True if it was notified."""
+        event = self._events.setdefault(task_id, asyncio.Event())
+        self._waiters[task_id] = self._waiters.get(task_id, 0) + 1
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._waiters[task_id] -= 1
+            if not self._waiters[task_id]:
+                del self._waiters[task_id]
+                if self._events.get(task_id) is event:
+                    del self._events[task_id]
+
+    def notify(self, task_id: str) -> None:
+        """Release everyone waiting on the task."""
+        event = self._events.pop(task_id, None)
+        if event is not None:
+            event.set()
\ No newline at end of file
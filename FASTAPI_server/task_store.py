@@ -0,0 +1,103 @@
+import json
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+class TaskStore(ABC):
+    """Interface for storing task state records keyed by task_id."""
+
+    @abstractmethod
+    def get(self, task_id: str) -> dict | None:
+        """Return the record for a task, or None if it is unknown or expired."""
+
+    @abstractmethod
+    def set(self, task_id: str, record: dict) -> None:
+        """Create or replace the record for a task."""
+
+    @abstractmethod
+    def delete(self, task_id: str) -> None:
+        """Remove the record for a task if it exists."""
+
+    def __contains__(self, task_id: str) -> bool:
+        return self.get(task_id) is not None
+
+class MemoryTaskStore(TaskStore):
+    """In-process task store with LRU and TTL eviction."""
+
+    def __init__(self, max_items: int, ttl: float) -> None:
+        self.max_items: int = max_items
+        self.ttl: float = ttl
+        self._records: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+
+    def get(self, task_id: str) -> dict | None:
+        entry = self._records.get(task_id)
+        if entry is None:
+            return None
+        updated_at, record = entry
+        if time.monotonic() - updated_at > self.ttl:
+            del self._records[task_id]
+            return None
+        self._records.move_to_end(task_id)
+        return record
+
+    def set(self, task_id: str, record: dict) -> None:
+        self._records[task_id] = (time.monotonic(), record)
+        self._records.move_to_end(task_id)
+        self._evict()
+
+    def delete(self, task_id: str) -> None:
+        self._records.pop(task_id, None)
+
+    def _evict(self) -> None:
+        """Drop expired records from the cold end, then trim to max_items."""
+        now = time.monotonic()
+        while self._records:
+            oldest_id, (updated_at, _) = next(iter(self._records.items()))
+            if now - updated_at <= self.ttl and len(self._records) <= self.max_items:
+                break
+            del self._records[oldest_id]
+
+class SQLiteTaskStore(TaskStore):
+    """Task store on a local SQLite file, shareable between several server processes."""
+
+    def __init__(self, path: str, ttl: float) -> None:
+        self.ttl: float = ttl
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS tasks ("
+            "task_id TEXT PRIMARY KEY, record TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS tasks_updated_at ON tasks (updated_at)")
+
+    def get(self, task_id: str) -> dict | None:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT record FROM tasks WHERE task_id = ? AND updated_at >= ?",
+                (task_id, time.time() - self.ttl)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, task_id: str, record: dict) -> None:
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO tasks (task_id, record, updated_at) VALUES (?, ?, ?)",
+                (task_id, json.dumps(record), now)
+            )
+            self._connection.execute("DELETE FROM tasks WHERE updated_at < ?", (now - self.ttl,))
+
+    def delete(self, task_id: str) -> None:
+        with self._lock:
+            self._connection.execute("DELETE FROM tasks WHERE task_id = ?", (task_id,))
+
+def create_task_store(backend: str, path: str, max_items: int, ttl: float) -> TaskStore:
+    """Build the task store selected in the configuration."""
+    if backend == 'memory':
+        return MemoryTaskStore(max_items=max_items, ttl=ttl)
+    if backend == 'sqlite':
+        return SQLiteTaskStore(path=path, ttl=ttl)
+    raise ValueError(f"Unknown task store backend: {backend}")
\ No newline at end of file